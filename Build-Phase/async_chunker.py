@@ -0,0 +1,186 @@
+import time
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple, Union
+from build3 import Span, chunker
+from language_detection import language_from_path
+from parser_pool import POOL
+from repo_chunker import ChunkStats
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A file is a path to read, or a (path, contents) pair already in memory
+File = Union[str, Tuple[str, bytes]]
+Result = Tuple[str, Optional[str], List[Span]]
+CLOSE = object()  # queued by close(): the batcher sends off what it holds and stops
+
+def _chunk_one(file: File, MAX_CHARS: int, coalesce: int) -> Tuple[Result, int]:
+    if isinstance(file, str):
+        path = file
+        with open(path, 'rb') as f:
+            source_code = f.read()
+    else:
+        path, source_code = file
+    language = language_from_path(path)
+    if language is None or not source_code:
+        return (path, language, []), len(source_code)
+    try:
+        with POOL.parser(language) as parser:
+            tree = parser.parse(source_code)
+        spans = chunker(tree, source_code, MAX_CHARS, coalesce)
+    except Exception as e:
+        logger.warning(f"Failed to chunk {path}: {e}")
+        spans = []
+    return (path, language, spans), len(source_code)
+
+def _chunk_batch(files: List[File], MAX_CHARS: int, coalesce: int) -> List[Union[Tuple[Result, int], Exception]]:
+    # Runs on a worker: one call per batch keeps executor round trips off the per-file path.
+    # A file that cannot be read fails on its own, not the whole batch.
+    results = []
+    for file in files:
+        try:
+            results.append(_chunk_one(file, MAX_CHARS, coalesce))
+        except OSError as e:
+            results.append(e)
+    return results
+
+class AsyncChunker:
+    # asyncio front-end for the chunker. Requests are queued, grouped into batches of up to
+    # batch_size (or whatever arrived within batch_delay seconds) and chunked on an executor,
+    # so the event loop never parses. At most max_pending files are accepted at once; further
+    # callers wait, which is the backpressure. Pass a ProcessPoolExecutor to scale past the GIL.
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        max_workers: Optional[int] = None,
+        max_pending=256,
+        batch_size=32,
+        batch_delay=0.002,
+        MAX_CHARS=512 * 3,
+        coalesce=50,
+        stats: Optional[ChunkStats] = None
+    ):
+        self.executor = executor
+        self.owns_executor = executor is None
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.MAX_CHARS = MAX_CHARS
+        self.coalesce = coalesce
+        self.stats = stats if stats is not None else ChunkStats()
+        self.queue: Optional[asyncio.Queue] = None
+        self.pending: Optional[asyncio.Semaphore] = None
+        self.batcher: Optional[asyncio.Task] = None
+        self.running = set()  # batches handed to the executor and not finished yet
+        self.started = 0.0
+
+    async def start(self):
+        if self.batcher is not None:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='chunker')
+        self.started = time.perf_counter()
+        self.queue = asyncio.Queue()
+        self.pending = asyncio.Semaphore(self.max_pending)
+        self.batcher = asyncio.create_task(self._batch_loop())
+
+    async def close(self):
+        if self.batcher is None:
+            return
+        # Requests queued before this point are still chunked
+        await self.queue.put(CLOSE)
+        await self.batcher
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+        # Anything queued after close() began will not be served
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not CLOSE and not item[1].done():
+                item[1].cancel()
+        self.batcher = None
+        if self.owns_executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            item = await self.queue.get()
+            if item is CLOSE:
+                break
+            batch = [item]
+            try:
+                deadline = loop.time() + self.batch_delay
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is CLOSE:
+                        closing = True
+                        break
+                    batch.append(item)
+            except asyncio.CancelledError:
+                # Requests already taken off the queue would otherwise never be answered
+                for _, future in batch:
+                    if not future.done():
+                        future.cancel()
+                raise
+            task = asyncio.create_task(self._run_batch(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _run_batch(self, batch: List[Tuple[File, asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.executor, _chunk_batch, [file for file, _ in batch], self.MAX_CHARS, self.coalesce)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.stats.seconds = time.perf_counter() - self.started
+        for (_, future), outcome in zip(batch, results):
+            if isinstance(outcome, Exception):
+                if not future.done():
+                    future.set_exception(outcome)
+                continue
+            result, size = outcome
+            self.stats.files += 1
+            self.stats.bytes += size
+            self.stats.chunks += len(result[2])
+            if not future.done():
+                future.set_result(result)
+
+    async def chunk(self, file: File) -> Result:
+        # (path, language, line spans) for one file, as repo_chunker.chunk_files yields them
+        await self.start()
+        async with self.pending:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((file, future))
+            return await future
+
+    async def chunk_many(self, files: Iterable[File]) -> List[Result]:
+        # Results in the order of `files`
+        return list(await asyncio.gather(*(self.chunk(file) for file in files)))
+
+async def chunk_many(files: Iterable[File], **kwargs) -> List[Result]:
+    # One-off convenience; long-running services should keep an AsyncChunker open instead
+    async with AsyncChunker(**kwargs) as service:
+        return await service.chunk_many(files)
@@ -0,0 +1,389 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import resource
+import contextlib
+import multiprocessing
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional
+from grammars import LANGUAGE_NAMES, REGISTRY
+from language_detection import EXTENSIONS, language_from_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KB, MB = 1024, 1024 * 1024
+SIZES = [1 * KB, 64 * KB, 1 * MB, 10 * MB, 50 * MB]
+BASELINE_PATH = 'cache/benchmark_baseline.json'
+TOLERANCE = 0.2  # slower than the baseline by more than this fraction counts as a regression
+MIN_SECONDS = 0.005  # cases faster than this in both runs are too noisy to compare
+MAX_CHARS = 512 * 3
+COALESCE = 50
+
+# One repeatable unit per language; {i} makes every copy distinct and {body} varies its length
+TEMPLATES = {
+    'python': '''
+class Widget{i}:
+    def __init__(self, value):
+        self.value = value
+
+    def compute(self, x):
+{body}
+        return x + self.value
+
+def helper_{i}(items):
+    return [item * {i} for item in items if item % 3]
+''',
+    'java': '''
+class Widget{i} {{
+    private int value;
+
+    Widget{i}(int value) {{
+        this.value = value;
+    }}
+
+    int compute(int x) {{
+{body}
+        return x + value;
+    }}
+}}
+''',
+    'cpp': '''
+class Widget{i} {{
+public:
+    explicit Widget{i}(int value) : value(value) {{}}
+
+    int compute(int x) {{
+{body}
+        return x + value;
+    }}
+
+private:
+    int value;
+}};
+''',
+    'go': '''
+type Widget{i} struct {{
+	value int
+}}
+
+func (w *Widget{i}) Compute(x int) int {{
+{body}
+	return x + w.value
+}}
+''',
+    'rust': '''
+struct Widget{i} {{
+    value: i64,
+}}
+
+impl Widget{i} {{
+    fn compute(&self, x: i64) -> i64 {{
+{body}
+        x + self.value
+    }}
+}}
+''',
+    'ruby': '''
+class Widget{i}
+  def initialize(value)
+    @value = value
+  end
+
+  def compute(x)
+{body}
+    x + @value
+  end
+end
+''',
+    'php': '''
+class Widget{i} {{
+    private $value;
+
+    public function __construct($value) {{
+        $this->value = $value;
+    }}
+
+    public function compute($x) {{
+{body}
+        return $x + $this->value;
+    }}
+}}
+''',
+}
+STATEMENTS = {
+    'python': '        x = x * {n} + {i}',
+    'java': '        x = x * {n} + {i};',
+    'cpp': '        x = x * {n} + {i};',
+    'go': '\tx = x*{n} + {i}',
+    'rust': '        let x = x * {n} + {i};',
+    'ruby': '    x = x * {n} + {i}',
+    'php': '        $x = $x * {n} + {i};',
+}
+PREAMBLE = {'go': 'package main\n', 'php': '<?php\n'}
+# First extension listed for each language, to name fixtures so chunk() detects them
+EXTENSIONS_BY_LANGUAGE = {language: extension for extension, language in reversed(list(EXTENSIONS.items()))}
+
+def synthetic_source(language: str, size: int, seed=0) -> bytes:
+    # Deterministic source of roughly `size` bytes; method bodies vary so some exceed MAX_CHARS
+    rng = random.Random(seed)
+    parts = [PREAMBLE.get(language, '')]
+    total = len(parts[0])
+    i = 0
+    while total < size:
+        body = '\n'.join(STATEMENTS[language].format(n=n, i=i) for n in range(rng.choice([1, 2, 4, 8, 64])))
+        part = TEMPLATES[language].format(i=i, body=body)
+        parts.append(part)
+        total += len(part)
+        i += 1
+    return ''.join(parts).encode('utf8')
+
+def corpus_source(language: str, size: int, corpus: str) -> bytes:
+    # Real files of the language from the corpus, concatenated up to `size` bytes
+    from repo_chunker import iter_source_files
+    parts: List[bytes] = []
+    total = 0
+    for path in iter_source_files(corpus):
+        if total >= size:
+            break
+        if language_from_path(path) != language:
+            continue
+        with open(path, 'rb') as f:
+            data = f.read(size - total)
+        parts.append(data)
+        total += len(data) + 1
+    return b'\n'.join(parts)
+
+@contextlib.contextmanager
+def timed(timings: Dict[str, float], phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+# Each benchmark takes (source, language, counts) and returns seconds per phase; setup is not
+# timed. Anything worth comparing besides time, like the number of chunks, goes in counts.
+
+def phases_from(metrics, timings: Dict[str, float], counts: Dict[str, int]) -> Dict[str, float]:
+    # The per-step phases and counters chunker/chunk recorded, so a regression shows which step
+    # slowed down. Their phases don't nest, so they still add up to the whole call.
+    for name, stats in metrics.phases.items():
+        timings[name] = timings.get(name, 0.0) + stats.seconds
+    counts.update(metrics.counters)
+    return timings
+
+def bench_chunker(source_code: bytes, language: str, counts: Dict[str, int], mode='greedy') -> Dict[str, float]:
+    from build3 import chunker
+    from metrics import Metrics
+    from parser_pool import POOL
+    timings: Dict[str, float] = {}
+    with POOL.parser(language) as parser:
+        with timed(timings, 'parse'):
+            tree = parser.parse(source_code)
+    metrics = Metrics()
+    chunks = chunker(tree, source_code, MAX_CHARS, COALESCE, metrics=metrics, mode=mode)
+    counts['chunks'] = len(chunks)
+    return phases_from(metrics, timings, counts)
+
+def bench_chunker_optimal(source_code: bytes, language: str, counts: Dict[str, int]) -> Dict[str, float]:
+    return bench_chunker(source_code, language, counts, mode='optimal')
+
+def bench_chunk(source_code: bytes, language: str, counts: Dict[str, int]) -> Dict[str, float]:
+    from build1 import chunk
+    from language_detection import LanguageDetector
+    from metrics import Metrics
+    metrics = Metrics()
+    detector = LanguageDetector(REGISTRY, metrics)
+    path = f'fixture{EXTENSIONS_BY_LANGUAGE[language]}'
+    chunks = chunk(source_code, REGISTRY, path=path, detector=detector, metrics=metrics)
+    counts['chunks'] = len(chunks)
+    return phases_from(metrics, {}, counts)
+
+def bench_identify_constructs(source_code: bytes, language: str, counts: Dict[str, int]) -> Dict[str, float]:
+    from build7 import identify_constructs
+    from parser_pool import POOL
+    timings: Dict[str, float] = {}
+    with POOL.parser('python') as parser:
+        with timed(timings, 'identify_constructs'):
+            identify_constructs(source_code, parser)
+    return timings
+
+def bench_create_relations(source_code: bytes, language: str, counts: Dict[str, int]) -> Dict[str, float]:
+    from build7 import create_relations, identify_constructs
+    from parser_pool import POOL
+    with POOL.parser('python') as parser:
+        constructs = identify_constructs(source_code, parser)
+    timings: Dict[str, float] = {}
+    with timed(timings, 'create_relations'):
+        create_relations(constructs)
+    return timings
+
+def bench_print_ast_tree(source_code: bytes, language: str, counts: Dict[str, int]) -> Dict[str, float]:
+    from build5 import print_ast_tree
+    code = source_code.decode('utf8', 'replace')
+    timings: Dict[str, float] = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with timed(timings, 'print_ast_tree'):
+            print_ast_tree(code)
+    return timings
+
+@dataclass
+class Benchmark:
+    run: Callable[[bytes, str, Dict[str, int]], Dict[str, float]]
+    languages: Optional[List[str]] = None  # None for every available grammar
+    max_bytes: Optional[int] = None  # larger fixtures are skipped
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    'chunker': Benchmark(bench_chunker),
+    'chunker_optimal': Benchmark(bench_chunker_optimal),
+    'chunk': Benchmark(bench_chunk),
+    'identify_constructs': Benchmark(bench_identify_constructs, ['python']),
+    'create_relations': Benchmark(bench_create_relations, ['python']),
+    'print_ast_tree': Benchmark(bench_print_ast_tree, ['python'], max_bytes=1 * MB),
+}
+
+@dataclass
+class Result:
+    benchmark: str
+    language: str
+    fixture: str  # "synthetic" or "corpus"
+    size: int  # requested fixture size
+    bytes: int = 0  # actual fixture size
+    phases: Dict[str, float] = field(default_factory=dict)  # best seconds per phase
+    seconds: float = 0.0
+    peak_rss_mb: float = 0.0  # of the process running this case alone
+    rss_before_mb: float = 0.0  # after the fixture was built, before the benchmark
+    counts: Dict[str, int] = field(default_factory=dict)  # e.g. chunks produced, from the last run
+
+    @property
+    def key(self) -> str:
+        return f"{self.benchmark}/{self.language}/{self.fixture}/{self.size}"
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / MB / self.seconds if self.seconds else 0.0
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / MB if sys.platform == 'darwin' else peak / KB
+
+def run_case(benchmark: str, language: str, fixture: str, size: int, repeat=3, corpus: Optional[str] = None) -> Result:
+    result = Result(benchmark, language, fixture, size)
+    source_code = corpus_source(language, size, corpus) if fixture == 'corpus' else synthetic_source(language, size)
+    result.bytes = len(source_code)
+    # Warm up on a tiny fixture so imports and parser creation are not measured
+    BENCHMARKS[benchmark].run(synthetic_source(language, KB), language, {})
+    result.rss_before_mb = _peak_rss_mb()
+    for _ in range(repeat):
+        timings = BENCHMARKS[benchmark].run(source_code, language, result.counts)
+        for phase, seconds in timings.items():
+            result.phases[phase] = min(seconds, result.phases.get(phase, seconds))
+    result.seconds = sum(result.phases.values())
+    result.peak_rss_mb = _peak_rss_mb()
+    return result
+
+def _run_case(args) -> Result:
+    return run_case(*args)
+
+def iter_cases(benchmarks: List[str], languages: List[str], sizes: List[int], corpus: Optional[str]) -> Iterator[tuple]:
+    fixtures = ['synthetic'] + (['corpus'] if corpus else [])
+    for name in benchmarks:
+        benchmark = BENCHMARKS[name]
+        for language in languages:
+            if benchmark.languages is not None and language not in benchmark.languages:
+                continue
+            if not REGISTRY.is_available(language):
+                logger.info(f"Skipping {name}/{language}: grammar not installed")
+                continue
+            for fixture in fixtures:
+                for size in sizes:
+                    if benchmark.max_bytes is not None and size > benchmark.max_bytes:
+                        continue
+                    yield name, language, fixture, size
+
+def run(benchmarks: List[str], languages: List[str], sizes: List[int], repeat=3,
+        corpus: Optional[str] = None) -> Iterator[Result]:
+    # Every case runs in a fresh process so peak RSS belongs to that case alone
+    context = multiprocessing.get_context('spawn')
+    cases = [case + (repeat, corpus) for case in iter_cases(benchmarks, languages, sizes, corpus)]
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(_run_case, cases):
+            if not result.bytes:
+                logger.info(f"Skipping {result.key}: no {result.language} files in the corpus")
+                continue
+            yield result
+
+def load_results(path: str) -> Dict[str, Result]:
+    with open(path) as f:
+        results = [Result(**record) for record in json.load(f)]
+    return {result.key: result for result in results}
+
+def save_results(results: List[Result], path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump([asdict(result) for result in results], f, indent=1)
+
+def compare(results: List[Result], baseline: Dict[str, Result], tolerance=TOLERANCE) -> List[str]:
+    # Cases slower than the baseline by more than `tolerance`
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.key)
+        if previous is None or not previous.seconds or previous.bytes != result.bytes:
+            continue
+        if max(result.seconds, previous.seconds) < MIN_SECONDS:
+            continue
+        ratio = result.seconds / previous.seconds
+        if ratio > 1 + tolerance:
+            regressions.append(f"{result.key}: {result.seconds:.4f}s vs {previous.seconds:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+def format_size(size: int) -> str:
+    return f"{size // MB}MB" if size >= MB else f"{size // KB}KB"
+
+def format_result(result: Result, baseline: Optional[Result] = None) -> str:
+    phases = ', '.join([f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in result.phases.items()]
+                       + [f"{name} {value}" for name, value in result.counts.items()])
+    line = (f"{result.benchmark:<20} {result.language:<7} {result.fixture:<9} {format_size(result.size):>6} "
+            f"{result.seconds * 1000:>10.1f}ms {result.mb_per_second:>8.2f}MB/s {result.peak_rss_mb:>8.1f}MB "
+            f"(+{result.peak_rss_mb - result.rss_before_mb:.1f}MB)  [{phases}]")
+    if baseline is not None and baseline.seconds:
+        line += f"  {result.seconds / baseline.seconds:.2f}x baseline"
+    return line
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chunkers and graph builders")
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--languages', nargs='+', default=LANGUAGE_NAMES, choices=LANGUAGE_NAMES)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help="fixture sizes in bytes")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--corpus', help="directory of real source files to build fixtures from as well")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--output', help="also write the results as JSON here")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline) if os.path.exists(args.baseline) else {}
+    results = []
+    for result in run(args.benchmarks, args.languages, args.sizes, args.repeat, args.corpus):
+        results.append(result)
+        print(format_result(result, baseline.get(result.key)))
+    if args.output:
+        save_results(results, args.output)
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
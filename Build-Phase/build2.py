@@ -1,85 +1,141 @@
 import os
 import subprocess
 import logging
-from tree_sitter import Parser, Language
+from grammars import LANGUAGE_NAMES, REGISTRY, build_shared_object
+from language_detection import PREFIX_BYTES, LanguageDetector
+from line_windows import iter_line_windows, mapped
+from metrics import phase
+from traversal import iter_children
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-LANGUAGE_NAMES = ["python", "java", "cpp", "go", "rust", "ruby", "php"]
 MAX_CHARS = 1500
 CHUNK_SIZE = 50  # for naive chunking
 OVERLAP = 10  # for naive chunking
 
 def setup_languages():
-    languages = {}
+    # Grammars load lazily, the first time a language is used, from installed tree_sitter_<lang>
+    # wheels or prebuilt <lang>.so files, so this needs no network and no compiler
+    return REGISTRY
+
+def build_languages():
+    # Clones and compiles the grammars into cache/build, where the registry also looks.
+    # Only needed for grammars that have no wheel.
     for language in LANGUAGE_NAMES:
         # Clone the repository if it doesn't exist
         if not os.path.exists(f"cache/tree-sitter-{language}"):
             subprocess.run(f"git clone https://github.com/tree-sitter/tree-sitter-{language} cache/tree-sitter-{language}", shell=True)
-        
+
         # Build the language library
         if not os.path.exists(f'cache/build/{language}.so'):
-            os.makedirs('cache/build', exist_ok=True)
-            subprocess.run(f"cd cache/tree-sitter-{language} && tree-sitter generate && gcc -c -I./src -fPIC src/parser.c -o ../../build/{language}.o && gcc -shared -fPIC -o ../../build/{language}.so ../../build/{language}.o", shell=True)
-        
-        # Create language object
-        languages[language] = Language(f'cache/build/{language}.so', language)
-    
-    return languages
+            build_shared_object(language, f"cache/tree-sitter-{language}")
 
-def chunk_node(node, text, max_chars=MAX_CHARS):
-    new_chunks = []
-    current_chunk = ""
-    for child in node.children:
-        child_text = text[child.start_byte:child.end_byte]
-        if len(child_text) > max_chars:
-            if current_chunk:
-                new_chunks.append(current_chunk)
-                current_chunk = ""
-            new_chunks.extend(chunk_node(child, text, max_chars))
-        elif len(current_chunk) + len(child_text) > max_chars:
-            new_chunks.append(current_chunk)
-            current_chunk = child_text
+    return {language: REGISTRY[language] for language in LANGUAGE_NAMES if language in REGISTRY}
+
+def chunk_node_spans(node, max_chars=MAX_CHARS, metrics=None):
+    # Byte ranges of the chunks, nothing is sliced or copied here
+    spans = []
+    visited = 0
+    # Explicit stack of (remaining children, open chunk) instead of recursing into large children
+    stack = [(iter_children(node), None, None)]
+    while stack:
+        children, start, end = stack.pop()
+        for child in children:
+            visited += 1
+            if child.end_byte - child.start_byte > max_chars:
+                if start is not None:
+                    spans.append((start, end))
+                stack.append((children, None, None))
+                stack.append((iter_children(child), None, None))
+                break
+            elif start is not None and child.end_byte - start > max_chars:
+                spans.append((start, end))
+                start, end = child.start_byte, child.end_byte
+            else:
+                if start is None:
+                    start = child.start_byte
+                end = child.end_byte
         else:
-            current_chunk += child_text
-    
-    if current_chunk:
-        new_chunks.append(current_chunk)
+            if start is not None:
+                spans.append((start, end))
     
-    return new_chunks
+    if metrics is not None:
+        metrics.count('nodes_visited', visited)
+    return spans
+
+def materialize(source_code, spans):
+    # Decodes each chunk straight out of the source buffer
+    view = memoryview(source_code)
+    return [str(view[start:end], "utf-8", "replace") for start, end in spans]
 
-def chunk(text, languages, max_chars=MAX_CHARS):
+def chunk_node(node, text, max_chars=MAX_CHARS):
+    source_code = text if isinstance(text, (bytes, memoryview)) else bytes(text, "utf-8")
+    return materialize(source_code, chunk_node_spans(node, max_chars))
+
+def chunk(text, languages, max_chars=MAX_CHARS, path=None, detector=None, as_spans=False,
+          metrics=None):
+    # With as_spans the chunks come back as (start_byte, end_byte) ranges of the utf-8 source.
+    # With metrics, time, allocations and counts are recorded per step (see metrics.py).
     # Determining the language
-    file_language = None
-    for language_name, language in languages.items():
-        parser = Parser()
-        parser.set_language(language)
-        tree = parser.parse(bytes(text, "utf-8"))
-        if not tree.root_node.children or tree.root_node.children[0].type != "ERROR":
-            file_language = language
-            break
-        logger.warning(f"Not language {language_name}")
+    detector = detector or LanguageDetector(languages, metrics)
+    source_code = text if isinstance(text, bytes) else bytes(text, "utf-8")
+    with phase(metrics, 'detection'):
+        file_language = detector.detect(source_code, path)
+    record_detection(metrics, source_code, file_language)
     
     # Smart chunker
     if file_language:
-        return chunk_node(tree.root_node, text, max_chars)
+        return chunk_tree(detector.parser(file_language), source_code, max_chars, as_spans, metrics)
     
     # Naive algorithm
     logger.warning("Falling back to naive chunking")
-    source_lines = text.split('\n')
-    num_lines = len(source_lines)
-    logger.info(f"Number of lines: {num_lines}")
-    chunks = []
-    start_line = 0
-    while start_line < num_lines:
-        end_line = min(start_line + CHUNK_SIZE, num_lines)
-        chunk = '\n'.join(source_lines[start_line:end_line])
-        chunks.append(chunk)
-        start_line += CHUNK_SIZE - OVERLAP
-    
-    return chunks
+    with phase(metrics, 'naive'):
+        return list(naive_chunk(source_code, as_spans))
+
+def chunk_file(path, languages, max_chars=MAX_CHARS, detector=None, as_spans=False, metrics=None):
+    # chunk() for a file on disk, as an iterator. The file is memory-mapped and only a prefix is
+    # used for detection; the naive windows are decoded straight from the mapping one at a time,
+    # so logs and data files of any size chunk in constant memory.
+    detector = detector or LanguageDetector(languages, metrics)
+    with mapped(path) as source_code:
+        with phase(metrics, 'detection'):
+            file_language = detector.detect(source_code[:PREFIX_BYTES + 1], path)
+        record_detection(metrics, source_code, file_language)
+        if file_language:
+            # tree-sitter needs the whole file as bytes
+            yield from chunk_tree(detector.parser(file_language), source_code[:], max_chars, as_spans, metrics)
+            return
+        logger.warning(f"Falling back to naive chunking for {path}")
+        yield from naive_chunk(source_code, as_spans)
+
+def record_detection(metrics, source_code, file_language):
+    if metrics is not None:
+        metrics.count('chunk_calls')
+        metrics.count('chunk_bytes', len(source_code))
+        if not file_language:
+            metrics.count('naive_fallbacks')
+        metrics.gauge('fallback_rate', metrics.counters.get('naive_fallbacks', 0) / metrics.counters['chunk_calls'])
+
+def chunk_tree(parser, source_code, max_chars=MAX_CHARS, as_spans=False, metrics=None):
+    with phase(metrics, 'parse'):
+        tree = parser.parse(source_code)
+    with phase(metrics, 'chunk_node'):
+        spans = chunk_node_spans(tree.root_node, max_chars, metrics)
+    if as_spans:
+        return spans
+    with phase(metrics, 'materialize'):
+        return materialize(source_code, spans)
+
+def naive_chunk(source_code, as_spans=False):
+    # Overlapping windows of CHUNK_SIZE lines, found in one scan of the buffer (bytes or mmap)
+    # and produced lazily
+    windows = iter_line_windows(source_code, CHUNK_SIZE, OVERLAP)
+    if as_spans:
+        return windows
+    view = memoryview(source_code)
+    return (str(view[start:end], "utf-8", "replace") for start, end in windows)
 
 def main():
     # Setup languages
@@ -103,12 +159,13 @@ if __name__ == "__main__":
     print(obj.get_value())
     """
     
-    chunks = chunk(sample_code, languages)
+    detector = LanguageDetector(languages)
+    chunks = chunk(sample_code, languages, detector=detector)
     
     print("Chunked code:")
-    for i, chunk in enumerate(chunks, 1):
+    for i, chunk_text in enumerate(chunks, 1):
         print(f"Chunk {i}:")
-        print(chunk)
+        print(chunk_text)
         print("-" * 40)
 
 if __name__ == "__main__":
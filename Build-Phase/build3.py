@@ -1,7 +1,13 @@
 import re
+from collections import deque
 from dataclasses import dataclass
-from typing import List
-from tree_sitter import Parser, Language, Tree, Node
+from typing import Iterable, Iterator, List, Optional, Tuple
+from tree_sitter import Parser, Tree, Node
+from grammars import get_language
+from line_index import LineIndex
+from metrics import Metrics, phase
+from text_stats import TextStats
+from traversal import iter_children
 
 @dataclass
 class Span:
@@ -20,68 +26,317 @@ class Span:
 def non_whitespace_len(text: bytes) -> int:
     return len(re.sub(rb'\s', b'', text))
 
+WHITESPACE = b' \t\n\r\x0b\x0c'  # what rb'\s' matches
+
+MODES = ('greedy', 'optimal')
+SPLIT_PENALTY = 0.5  # cost of a boundary inside a function/class, per enclosing one, in chunks
+# Function and class nodes across the supported grammars; optimal mode avoids splitting inside them
+CONSTRUCT_TYPES = frozenset([
+    'function_definition', 'class_definition', 'decorated_definition',  # python, cpp, php
+    'class_declaration', 'interface_declaration', 'enum_declaration', 'trait_declaration',
+    'method_declaration', 'constructor_declaration',  # java, go, php
+    'class_specifier', 'struct_specifier',  # cpp
+    'function_declaration',  # go
+    'function_item', 'impl_item', 'trait_item', 'mod_item',  # rust
+    'method', 'singleton_method', 'class', 'module',  # ruby
+])
+
 def get_line_number(byte_offset: int, source_code: bytes) -> int:
     return source_code[:byte_offset].count(b'\n') + 1
 
-def chunker(
-    tree: Tree,
-    source_code: bytes,
+def chunk_node(node: Node, MAX_CHARS=512 * 3, metrics: Optional[Metrics] = None) -> List[Span]:
+    return chunk_children(iter_children(node), node.start_byte, MAX_CHARS, metrics)
+
+def chunk_children(
+    children: Iterable[Node],
+    start_byte: int,
     MAX_CHARS=512 * 3,
-    coalesce=50  # Any chunk less than 50 characters long gets coalesced with the next chunk
+    metrics: Optional[Metrics] = None
 ) -> List[Span]:
-
-    # 1. Recursively form chunks
-    def chunk_node(node: Node) -> List[Span]:
-        chunks: List[Span] = []
-        current_chunk: Span = Span(node.start_byte, node.start_byte)
-        node_children = node.children
-        for child in node_children:
+    chunks: List[Span] = []
+    visited = 0
+    # Explicit stack of (remaining children, current chunk) instead of recursing into large children
+    stack = [(iter(children), Span(start_byte, start_byte))]
+    while stack:
+        children, current_chunk = stack.pop()
+        for child in children:
+            visited += 1
             if child.end_byte - child.start_byte > MAX_CHARS:
                 chunks.append(current_chunk)
-                current_chunk = Span(child.end_byte, child.end_byte)
-                chunks.extend(chunk_node(child))
+                stack.append((children, Span(child.end_byte, child.end_byte)))
+                stack.append((iter_children(child), Span(child.start_byte, child.start_byte)))
+                break
             elif child.end_byte - child.start_byte + len(current_chunk) > MAX_CHARS:
                 chunks.append(current_chunk)
                 current_chunk = Span(child.start_byte, child.end_byte)
             else:
                 current_chunk += Span(child.start_byte, child.end_byte)
-        chunks.append(current_chunk)
-        return chunks
-    
-    chunks = chunk_node(tree.root_node)
+        else:
+            chunks.append(current_chunk)
+    if metrics is not None:
+        metrics.count('nodes_visited', visited)
+    return chunks
 
-    # 2. Filling in the gaps
+def boundary_atoms(
+    node: Node,
+    MAX_CHARS=512 * 3,
+    metrics: Optional[Metrics] = None
+) -> Tuple[List[int], List[int], List[int]]:
+    # The nodes chunk_node packs, in order: children of node, descending into those larger than
+    # MAX_CHARS as chunk_node does. Returns their starts, ends, and for the boundary before each
+    # one how many of the function/class nodes it descended into enclose that boundary.
+    starts: List[int] = []
+    ends: List[int] = []
+    depths: List[int] = []
+    visited = 0
+    depth = 0  # constructs descended into that already hold an atom
+    pending = 0  # constructs descended into since the last atom
+    # (remaining children, whether the node being descended into is a construct, atoms before it)
+    stack = [(iter_children(node), False, 0)]
+    while stack:
+        children, construct, atoms_before = stack[-1]
+        for child in children:
+            visited += 1
+            if child.end_byte - child.start_byte > MAX_CHARS and child.child_count:
+                is_construct = child.type in CONSTRUCT_TYPES
+                pending += is_construct
+                stack.append((iter_children(child), is_construct, len(starts)))
+                break
+            # The boundary before the first atom of a construct is outside it, later ones inside
+            depths.append(depth)
+            starts.append(child.start_byte)
+            ends.append(child.end_byte)
+            depth += pending
+            pending = 0
+        else:
+            stack.pop()
+            if construct:
+                if len(starts) > atoms_before:
+                    depth -= 1
+                else:
+                    pending -= 1
+    if metrics is not None:
+        metrics.count('nodes_visited', visited)
+    return starts, ends, depths
+
+def optimal_chunk_node(
+    node: Node,
+    MAX_CHARS=512 * 3,
+    split_penalty=SPLIT_PENALTY,
+    metrics: Optional[Metrics] = None
+) -> List[Span]:
+    # Chunks with boundaries only between the nodes chunk_node would pack, chosen to minimize
+    # the number of chunks plus split_penalty for every function/class a boundary falls inside.
+    # Unlike chunk_node, a chunk may run on across the end of a node that had to be split, so the
+    # small leftovers there don't become chunks of their own.
+    starts, ends, depths = boundary_atoms(node, MAX_CHARS, metrics)
+    n = len(starts)
+    if n == 0:
+        return [Span(node.start_byte, node.start_byte)]
+    # cost[i]: cheapest way to chunk the first i atoms, with a boundary before atom i.
+    # The atoms a chunk ending at atom j - 1 may start from form a window that only moves
+    # right as j grows, so a monotonic deque gives each minimum in amortized O(1).
+    cost = [0.0] * (n + 1)
+    previous = [0] * (n + 1)
+    window = deque()  # boundary indices, with increasing cost including their penalty
+    low = 0
+
+    def boundary_cost(i: int) -> float:
+        return cost[i] + split_penalty * depths[i] if i else 0.0
+
+    for j in range(1, n + 1):
+        candidate = boundary_cost(j - 1)
+        while window and boundary_cost(window[-1]) >= candidate:
+            window.pop()
+        window.append(j - 1)
+        # A single atom always makes a chunk, even one larger than MAX_CHARS
+        while low < j - 1 and ends[j - 1] - starts[low] > MAX_CHARS:
+            low += 1
+        while window[0] < low:
+            window.popleft()
+        previous[j] = window[0]
+        cost[j] = boundary_cost(window[0]) + 1
+    chunks = []
+    j = n
+    while j:
+        i = previous[j]
+        chunks.append(Span(starts[i], ends[j - 1]))
+        j = i
+    chunks.reverse()
+    return chunks
+
+def fill_gaps(chunks: List[Span], end_byte: int) -> List[Span]:
     for prev, curr in zip(chunks[:-1], chunks[1:]):
         prev.end = curr.start
-    chunks[-1].end = tree.root_node.end_byte
+    chunks[-1].end = end_byte
+    return chunks
 
-    # 3. Combining small chunks with bigger ones
+def is_coalesced(chunk: Span, source_code: bytes, coalesce=50, stats: Optional[TextStats] = None) -> bool:
+    if stats is None:
+        return non_whitespace_len(chunk.extract(source_code)) > coalesce \
+            and b"\n" in chunk.extract(source_code)
+    return stats.non_whitespace_len(chunk.start, chunk.end) > coalesce \
+        and stats.has_newline(chunk.start, chunk.end)
+
+def coalesce_chunks(
+    chunks: List[Span],
+    source_code: bytes,
+    coalesce=50,
+    start_byte=0,
+    stats: Optional[TextStats] = None
+) -> List[Span]:
+    # Prefix sums keep each check O(1), so coalescing is linear in the number of chunks.
+    # Built here they only cover the chunks being coalesced, not the whole buffer.
+    if stats is None and chunks:
+        stats = TextStats(source_code, min(start_byte, min(chunk.start for chunk in chunks)),
+                          max(chunk.end for chunk in chunks))
     new_chunks = []
-    current_chunk = Span(0, 0)
+    current_chunk = Span(start_byte, start_byte)
     for chunk in chunks:
         current_chunk += chunk
-        if non_whitespace_len(current_chunk.extract(source_code)) > coalesce \
-            and b"\n" in current_chunk.extract(source_code):
+        if is_coalesced(current_chunk, source_code, coalesce, stats):
             new_chunks.append(current_chunk)
             current_chunk = Span(chunk.end, chunk.end)
     if len(current_chunk) > 0:
         new_chunks.append(current_chunk)
+    return new_chunks
 
-    # 4. Changing line numbers
-    line_chunks = [Span(get_line_number(chunk.start, source_code),
-                        get_line_number(chunk.end, source_code)) for chunk in new_chunks]
+def line_spans(chunks: List[Span], source_code: bytes) -> List[Span]:
+    line_index = LineIndex(source_code)
+    line_chunks = [Span(line_index.line_number(chunk.start),
+                        line_index.line_number(chunk.end)) for chunk in chunks]
+    return [chunk for chunk in line_chunks if len(chunk) > 0]
+
+def form_chunks(node: Node, MAX_CHARS=512 * 3, mode='greedy', metrics: Optional[Metrics] = None) -> List[Span]:
+    if mode == 'greedy':
+        return chunk_node(node, MAX_CHARS, metrics)
+    if mode == 'optimal':
+        return optimal_chunk_node(node, MAX_CHARS, metrics=metrics)
+    raise ValueError(f"Unknown chunking mode {mode!r}, expected one of {MODES}")
+
+def chunk_spans(
+    tree: Tree,
+    source_code: bytes,
+    MAX_CHARS=512 * 3,
+    coalesce=50,
+    mode='greedy'
+) -> List[Span]:
+    # Byte spans after steps 1-3 of chunker, the form incremental re-chunking works on
+    chunks = form_chunks(tree.root_node, MAX_CHARS, mode)
+    chunks = fill_gaps(chunks, tree.root_node.end_byte)
+    return coalesce_chunks(chunks, source_code, coalesce)
+
+def chunker(
+    tree: Tree,
+    source_code: bytes,
+    MAX_CHARS=512 * 3,
+    coalesce=50,  # Any chunk less than 50 characters long gets coalesced with the next chunk
+    metrics: Optional[Metrics] = None,  # records time, allocations and counts per step
+    mode='greedy'  # or 'optimal': fewest chunks, avoiding splits inside functions/classes
+) -> List[Span]:
+
+    # 1. Recursively form chunks
+    with phase(metrics, 'chunk_node'):
+        chunks = form_chunks(tree.root_node, MAX_CHARS, mode, metrics)
+
+    # 2. Filling in the gaps
+    with phase(metrics, 'fill_gaps'):
+        chunks = fill_gaps(chunks, tree.root_node.end_byte)
 
+    # 3. Combining small chunks with bigger ones
+    with phase(metrics, 'coalesce'):
+        new_chunks = coalesce_chunks(chunks, source_code, coalesce)
+
+    # 4. Changing line numbers
     # 5. Eliminating empty chunks
-    line_chunks = [chunk for chunk in line_chunks if len(chunk) > 0]
+    with phase(metrics, 'line_spans'):
+        line_chunks = line_spans(new_chunks, source_code)
 
+    if metrics is not None:
+        metrics.count('chunker_calls')
+        metrics.count('chunker_bytes', len(source_code))
+        metrics.count('chunks_before_coalesce', len(chunks))
+        metrics.count('chunks_after_coalesce', len(new_chunks))
+        metrics.count('line_chunks', len(line_chunks))
     return line_chunks
 
+def iter_chunk_node(node: Node, MAX_CHARS=512 * 3) -> Iterator[Span]:
+    # Same spans as chunk_node, produced as the traversal reaches them
+    stack = [(iter_children(node), Span(node.start_byte, node.start_byte))]
+    while stack:
+        children, current_chunk = stack.pop()
+        for child in children:
+            if child.end_byte - child.start_byte > MAX_CHARS:
+                yield current_chunk
+                stack.append((children, Span(child.end_byte, child.end_byte)))
+                stack.append((iter_children(child), Span(child.start_byte, child.start_byte)))
+                break
+            elif child.end_byte - child.start_byte + len(current_chunk) > MAX_CHARS:
+                yield current_chunk
+                current_chunk = Span(child.start_byte, child.end_byte)
+            else:
+                current_chunk += Span(child.start_byte, child.end_byte)
+        else:
+            yield current_chunk
+
+def iter_chunker(
+    tree: Tree,
+    source_code: bytes,
+    MAX_CHARS=512 * 3,
+    coalesce=50
+) -> Iterator[Span]:
+    # Streaming chunker: yields the same line spans as chunker, each one as soon as it is final.
+    # Counts are kept incrementally over the bytes each chunk adds, so no pass over the whole
+    # file is needed before the first chunk comes out.
+    line_offset, line_number = 0, 1
+
+    def to_line(byte_offset: int) -> int:
+        nonlocal line_offset, line_number
+        line_number += source_code.count(b'\n', line_offset, byte_offset)
+        line_offset = byte_offset
+        return line_number
+
+    def emit(chunk: Span) -> Iterator[Span]:
+        # 4. Changing line numbers, 5. Eliminating empty chunks
+        line_chunk = Span(to_line(chunk.start), to_line(chunk.end))
+        if len(line_chunk) > 0:
+            yield line_chunk
+
+    current_chunk = Span(0, 0)
+    non_whitespace, has_newline = 0, False
+
+    def add(chunk: Span):
+        # 3. Combining small chunks with bigger ones, counting only the newly covered bytes
+        nonlocal current_chunk, non_whitespace, has_newline
+        merged = current_chunk + chunk
+        for start, end in ((merged.start, current_chunk.start), (current_chunk.end, merged.end)):
+            if end > start:
+                piece = source_code[start:end]
+                non_whitespace += len(piece.translate(None, WHITESPACE))
+                has_newline = has_newline or b'\n' in piece
+        current_chunk = merged
+        if non_whitespace > coalesce and has_newline:
+            yield from emit(current_chunk)
+            current_chunk = Span(chunk.end, chunk.end)
+            non_whitespace, has_newline = 0, False
+
+    # 2. Filling in the gaps, one chunk behind the traversal
+    previous = None
+    for chunk in iter_chunk_node(tree.root_node, MAX_CHARS):
+        if previous is not None:
+            previous.end = chunk.start
+            yield from add(previous)
+        previous = chunk
+    previous.end = tree.root_node.end_byte
+    yield from add(previous)
+
+    if len(current_chunk) > 0:
+        yield from emit(current_chunk)
+
 def setup_parser(language: str) -> Parser:
-    # You need to build the language library beforehand and provide the correct path
-    LANGUAGE_SO_PATH = f'./build/my-languages.so'
-    language_library = Language(LANGUAGE_SO_PATH, language)
+    # Loaded from the tree_sitter_<language> wheel or a prebuilt <language>.so, see grammars.py
     parser = Parser()
-    parser.set_language(language_library)
+    parser.language = get_language(language)
     return parser
 
 def main():
@@ -1,68 +1,54 @@
-from tree_sitter import Language, Parser
-import tree_sitter_python
-
-def print_methods_with_content(code):
-    # Set up the parser
-    PY_LANGUAGE = Language(tree_sitter_python.language())
-    parser = Parser()
-    parser.language = PY_LANGUAGE 
-
-    # Parse the code
-    tree = parser.parse(bytes(code, "utf8"))
-
-    # Create a query to find function and method definitions
-    query = PY_LANGUAGE.query(
-        """
-        (function_definition
-          name: (identifier) @function.name
-          body: (block) @function.body)
-        (class_definition
-          name: (identifier) @class.name
-          body: (block (function_definition
-            name: (identifier) @method.name
-            body: (block) @method.body)))
-        """
-    )
-
-    # Find all matches
-    matches = query.captures(tree.root_node)
+import sys
+from dataclasses import dataclass
+from typing import Iterator, Optional
+from build3 import Span
+from extract import Construct, Extraction, extract
+
+@dataclass
+class MethodBody:
+    construct: Construct
+    span: Span  # byte range of the body in the source
+    lines: Span  # 1-based first and last line of the body, from the extraction's line index
+    source_code: bytes
+
+    @property
+    def view(self) -> memoryview:
+        # Zero-copy slice of the body
+        return memoryview(self.source_code)[self.span.start:self.span.end]
+
+    def text(self) -> str:
+        return str(self.view, 'utf8', 'replace')
+
+def iter_method_bodies(code, extraction: Optional[Extraction] = None) -> Iterator[MethodBody]:
+    # Bodies of every function and method in source order; nothing is copied or split until
+    # a caller asks for the text
+    if extraction is None:
+        extraction = extract(code)
+    source_code, line_index = extraction.source_code, extraction.line_index
+    for construct in extraction.of_kind('function', 'method'):
+        if construct.body_start_byte is None:
+            continue
+        span = Span(construct.body_start_byte, construct.body_end_byte)
+        lines = Span(line_index.line_number(span.start), line_index.line_number(span.end))
+        yield MethodBody(construct, span, lines, source_code)
+
+def print_methods_with_content(code, file=None):
+    # Thin printing layer over iter_method_bodies
+    file = file if file is not None else sys.stdout
 
     # Print the function and method names and content
-    print("Functions and methods defined in the program:")
+    print("Functions and methods defined in the program:", file=file)
     
-    class_name = None
-    for capture in matches:
-        node, capture_name = capture
+    for body in iter_method_bodies(code):
+        if body.construct.kind == 'method':
+            print(f"\n--- Method: {body.construct.name} ---", file=file)
+        else:
+            print(f"\n--- Function: {body.construct.name} ---", file=file)
+        
+        # Print the function content
+        print(body.text(), file=file)
         
-        if capture_name == "class.name":
-            class_name = node.text.decode('utf8')
-        elif capture_name in ["function.name", "method.name"]:
-            name = node.text.decode('utf8')
-            body_node = node.parent.child_by_field_name('body')
-            
-            if body_node:
-                start_line, start_col = body_node.start_point
-                end_line, end_col = body_node.end_point
-                
-                if class_name and capture_name == "method.name":
-                    print(f"\n--- Method: {class_name}.{name} ---")
-                else:
-                    print(f"\n--- Function: {name} ---")
-                
-                # Extract and print the function content
-                lines = code.split('\n')
-                for i in range(start_line, end_line + 1):
-                    if i == start_line:
-                        print(lines[i][start_col:])
-                    elif i == end_line:
-                        print(lines[i][:end_col])
-                    else:
-                        print(lines[i])
-                
-                print("-------------------")
-            
-            if capture_name == "function.name":
-                class_name = None  # Reset class_name for standalone functions
+        print("-------------------", file=file)
 
 # Example code
 code = """
@@ -126,4 +112,5 @@ if __name__ == "__main__":
     main()
 """
 
-print_methods_with_content(code)
\ No newline at end of file
+if __name__ == "__main__":
+    print_methods_with_content(code)
\ No newline at end of file
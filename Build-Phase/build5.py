@@ -1,30 +1,162 @@
-from tree_sitter import Language, Parser
-import tree_sitter_python
-
-def print_ast_tree(code):
-    # Set up the parser
-    PY_LANGUAGE = Language(tree_sitter_python.language())
-    parser = Parser()
-    parser.language = PY_LANGUAGE
-   
-    # Parse the code
-    tree = parser.parse(bytes(code, "utf8"))
+import os
+import sys
+import json
+import tempfile
+import struct
+from typing import Iterable, Iterator, Optional, Tuple
+from tree_sitter import Node
+from parser_pool import POOL
+from traversal import walk
+
+PREVIEW_CHARS = 20
+WRITE_BATCH = 4096  # lines joined per write
+BINARY_MAGIC = b'TSAST\x02'
+# depth, kind id, start byte, end byte, then start row, start column, end row, end column if
+# points are exported
+BINARY_RECORD = struct.Struct('<IHII')
+BINARY_RECORD_WITH_POINTS = struct.Struct('<IHIIIIII')
+# Version 1 stored depth as uint16, which deeply nested generated code overflows
+BINARY_RECORDS = {
+    BINARY_MAGIC: (BINARY_RECORD, BINARY_RECORD_WITH_POINTS),
+    b'TSAST\x01': (struct.Struct('<HHII'), struct.Struct('<HHIIIIII')),
+}
+
+def preview(source_code: bytes, node: Node, chars=PREVIEW_CHARS) -> str:
+    # First characters of the node's text, decoding only the bytes they can occupy
+    # (at most 4 per character) instead of the whole subtree like node.text does
+    end = min(node.end_byte, node.start_byte + 4 * chars)
+    return source_code[node.start_byte:end].decode('utf-8', 'replace')[:chars]
+
+def print_ast_tree(code, file=None):
+    # Parse the code with a pooled parser
+    source_code = code if isinstance(code, bytes) else bytes(code, "utf8")
+    with POOL.parser('python') as parser:
+        tree = parser.parse(source_code)
+    file = file if file is not None else sys.stdout
    
-    def traverse_tree(node, prefix="", is_last=True):
-        # Print the current node
-        connector = "└── " if is_last else "├── "
-        print(f"{prefix}{connector}{node.type}: {node.text.decode('utf-8')[:20]}")
-       
-        # Prepare the prefix for children
-        child_prefix = prefix + ("    " if is_last else "│   ")
-       
-        # Traverse children
-        children = node.children
-        for i, child in enumerate(children):
-            traverse_tree(child, child_prefix, i == len(children) - 1)
+    def traverse_tree(root):
+        # Child prefixes per depth, filled in as the pre-order walk goes down
+        prefixes = [""]
+        lines = []
+        for node, depth, is_last in walk(root):
+            prefix = prefixes[depth]
+            # Print the current node
+            connector = "└── " if is_last else "├── "
+            lines.append(f"{prefix}{connector}{node.type}: {preview(source_code, node)}")
+            if len(lines) >= WRITE_BATCH:
+                file.write("\n".join(lines) + "\n")
+                lines.clear()
+           
+            # Prepare the prefix for children
+            del prefixes[depth + 1:]
+            prefixes.append(prefix + ("    " if is_last else "│   "))
+        if lines:
+            file.write("\n".join(lines) + "\n")
 
     traverse_tree(tree.root_node)
 
+def iter_ast(root: Node, max_depth: Optional[int] = None, node_types: Optional[Iterable[str]] = None,
+             named_only=False) -> Iterator[Tuple[Node, int]]:
+    # (node, depth) in pre-order. max_depth prunes the walk; node_types and named_only only
+    # leave nodes out, their descendants are still visited
+    node_types = set(node_types) if node_types is not None else None
+    for node, depth, _ in walk(root, max_depth):
+        if named_only and not node.is_named:
+            continue
+        if node_types is not None and node.type not in node_types:
+            continue
+        yield node, depth
+
+def export_ast(code, path: str, format='jsonl', language='python', max_depth: Optional[int] = None,
+               node_types: Optional[Iterable[str]] = None, named_only=False, preview_chars=PREVIEW_CHARS,
+               points=True) -> int:
+    # Writes the tree in linear time through a large write buffer and returns the number of nodes.
+    # "jsonl": one object per node with depth, type, byte range, points and a text preview.
+    # "binary": BINARY_MAGIC, a length-prefixed JSON header with the grammar's node kinds,
+    # then one record per node and no text (slice the source by byte range instead).
+    # Row/column points are the most expensive part to collect; points=False leaves them out.
+    source_code = code if isinstance(code, bytes) else bytes(code, "utf8")
+    with POOL.parser(language) as parser:
+        tree = parser.parse(source_code)
+    if format not in ('jsonl', 'binary'):
+        raise ValueError(f"Unknown AST export format: {format}")
+    nodes = iter_ast(tree.root_node, max_depth, node_types, named_only)
+    count = 0
+    # Written under a temporary name and renamed into place, so a failed export leaves nothing
+    # that looks complete at path
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.ast-', suffix='.tmp')
+    os.close(fd)
+    try:
+        count = _write_ast(nodes, source_code, temp_path, format, language, preview_chars, points)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return count
+
+def _write_ast(nodes: Iterator[Tuple[Node, int]], source_code: bytes, path: str, format: str, language: str,
+               preview_chars: int, points: bool) -> int:
+    count = 0
+    if format == 'jsonl':
+        type_json = {}
+        with open(path, 'w', encoding='utf8', buffering=1024 * 1024) as f:
+            for node, depth in nodes:
+                node_type = type_json.get(node.type)
+                if node_type is None:
+                    node_type = type_json[node.type] = json.dumps(node.type)
+                text = json.dumps(preview(source_code, node, preview_chars), ensure_ascii=False)
+                if points:
+                    (start_row, start_column), (end_row, end_column) = node.start_point, node.end_point
+                    point_fields = f'"start_point":[{start_row},{start_column}],"end_point":[{end_row},{end_column}],'
+                else:
+                    point_fields = ''
+                f.write(f'{{"depth":{depth},"type":{node_type},"start_byte":{node.start_byte},'
+                        f'"end_byte":{node.end_byte},{point_fields}"text":{text}}}\n')
+                count += 1
+    elif format == 'binary':
+        grammar = POOL.language(language)
+        header = json.dumps({
+            'language': language,
+            'kinds': [grammar.node_kind_for_id(kind_id) for kind_id in range(grammar.node_kind_count)],
+            'points': points,
+        }).encode('utf8')
+        with open(path, 'wb', buffering=1024 * 1024) as f:
+            f.write(BINARY_MAGIC + struct.pack('<I', len(header)) + header)
+            if points:
+                pack = BINARY_RECORD_WITH_POINTS.pack
+                for node, depth in nodes:
+                    (start_row, start_column), (end_row, end_column) = node.start_point, node.end_point
+                    f.write(pack(depth, node.kind_id, node.start_byte, node.end_byte,
+                                 start_row, start_column, end_row, end_column))
+                    count += 1
+            else:
+                pack = BINARY_RECORD.pack
+                for node, depth in nodes:
+                    f.write(pack(depth, node.kind_id, node.start_byte, node.end_byte))
+                    count += 1
+    return count
+
+def read_ast_binary(path: str) -> Iterator[tuple]:
+    # (depth, type, start_byte, end_byte), plus start_point and end_point if they were exported,
+    # back from export_ast(format='binary')
+    with open(path, 'rb') as f:
+        records = BINARY_RECORDS.get(f.read(len(BINARY_MAGIC)))
+        if records is None:
+            raise ValueError(f"{path} is not a binary AST export")
+        header_size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_size))
+        kinds = header['kinds']
+        record = records[1] if header['points'] else records[0]
+        while True:
+            data = f.read(record.size * 4096)
+            if not data:
+                break
+            for fields in record.iter_unpack(data):
+                if header['points']:
+                    yield fields[0], kinds[fields[1]], fields[2], fields[3], fields[4:6], fields[6:8]
+                else:
+                    yield fields[0], kinds[fields[1]], fields[2], fields[3]
+
 # Example code
 code = """
 import random
@@ -51,4 +183,5 @@ if __name__ == "__main__":
     main()
 """
 
-print_ast_tree(code)
\ No newline at end of file
+if __name__ == "__main__":
+    print_ast_tree(code)
\ No newline at end of file
@@ -1,61 +1,30 @@
-from tree_sitter import Language, Parser
-import tree_sitter_python
 import networkx as nx
 import matplotlib.pyplot as plt
+from extract import extract
+from graph_export import export_graph
 
-def create_code_structure_graph(code):
-    # Set up the parser
-    PY_LANGUAGE = Language(tree_sitter_python.language())
-    parser = Parser()
-    parser.language = PY_LANGUAGE
+def create_code_structure_graph(code, graph=None):
+    # Modules, classes, functions and methods come from the shared single-pass extraction
+    extraction = extract(code)
     
-    # Parse the code
-    tree = parser.parse(bytes(code, "utf8"))
-    
-    # Create a NetworkX graph
-    G = nx.DiGraph()
-    
-    # Create a query to find modules, classes, functions, and methods
-    query = PY_LANGUAGE.query(
-        """
-        (module) @module
-        (class_definition
-          name: (identifier) @class.name) @class
-        (function_definition
-          name: (identifier) @function.name) @function
-        """
-    )
-    
-    # Find all matches
-    matches = query.captures(tree.root_node)
+    # Create a NetworkX graph, unless another backend (e.g. compact_graph.CompactGraph) is passed in
+    G = graph if graph is not None else nx.DiGraph()
     
     # Add nodes and edges to the graph
-    current_class = None
     G.add_node('module', type='module')
     
-    for node, node_type in matches:
-        if node_type == 'class':
-            class_name_node = node.child_by_field_name('name')
-            if class_name_node:
-                class_name = class_name_node.text.decode('utf8')
-                G.add_node(class_name, type='class')
-                G.add_edge('module', class_name)
-                current_class = class_name
-        elif node_type == 'function':
-            func_name_node = node.child_by_field_name('name')
-            if func_name_node:
-                func_name = func_name_node.text.decode('utf8')
-                if current_class:
-                    full_name = f"{current_class}.{func_name}"
-                    G.add_node(full_name, type='method')
-                    G.add_edge(current_class, full_name)
-                else:
-                    G.add_node(func_name, type='function')
-                    G.add_edge('module', func_name)
+    for construct in extraction.of_kind('class', 'function', 'method'):
+        G.add_node(construct.name, type=construct.kind)
+        G.add_edge(construct.parent or 'module', construct.name)
     
     return G
 
-def visualize_graph(G):
+def visualize_graph(G, output=None, **export_options):
+    # With an output path (.graphml, .dot, .json, .svg, .png) the graph is written headless
+    # with a hierarchical layout; see graph_export.export_graph for the options
+    if output is not None:
+        return export_graph(G, output, **export_options)
+
     pos = nx.spring_layout(G, k=0.9, iterations=50)
     
     node_colors = ['lightblue' if G.nodes[node]['type'] == 'module' else
@@ -107,8 +76,9 @@ if __name__ == "__main__":
     main()
 """
 
-# Create code structure graph
-G = create_code_structure_graph(code)
+if __name__ == "__main__":
+    # Create code structure graph
+    G = create_code_structure_graph(code)
 
-# Visualize the graph
-visualize_graph(G)
\ No newline at end of file
+    # Visualize the graph
+    visualize_graph(G)
\ No newline at end of file
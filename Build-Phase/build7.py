@@ -1,67 +1,24 @@
-from tree_sitter import Language, Parser
-import tree_sitter_python
 import networkx as nx
 import matplotlib.pyplot as plt
+from tree_sitter import Parser
+from grammars import get_language
+from parser_pool import POOL
+from extract import extract
+from graph_export import export_graph
 
 def setup_parser():
-    PY_LANGUAGE = Language(tree_sitter_python.language())
+    # A parser of its own; for repeated use borrow one with `with POOL.parser('python')` instead
     parser = Parser()
-    parser.language = PY_LANGUAGE
+    parser.language = get_language('python')
     return parser
 
 def identify_constructs(code, parser):
-    tree = parser.parse(bytes(code, "utf8"))
-    
-    query = parser.language.query(
-        """
-        (module) @module
-        (class_definition
-          name: (identifier) @class.name) @class
-        (function_definition
-          name: (identifier) @function.name) @function
-        (import_statement) @import
-        (import_from_statement) @import_from
-        (assignment
-          left: (identifier) @global_var
-          right: (_)) @global_assignment
-        """
-    )
-    
-    constructs = {
-        'module': [],
-        'class': [],
-        'function': [],
-        'method': [],
-        'import': [],
-        'global_var': []
-    }
-    
-    matches = query.captures(tree.root_node)
-    current_class = None
-    
-    for node, node_type in matches:
-        if node_type == 'module':
-            constructs['module'].append(('module', 'module'))
-        elif node_type == 'class':
-            class_name = node.child_by_field_name('name').text.decode('utf8')
-            constructs['class'].append((class_name, 'class'))
-            current_class = class_name
-        elif node_type == 'function':
-            func_name = node.child_by_field_name('name').text.decode('utf8')
-            if current_class:
-                constructs['method'].append((f"{current_class}.{func_name}", 'method'))
-            else:
-                constructs['function'].append((func_name, 'function'))
-        elif node_type in ['import', 'import_from']:
-            constructs['import'].append((node.text.decode('utf8').split()[1], 'import'))
-        elif node_type == 'global_var':
-            var_name = node.text.decode('utf8')
-            constructs['global_var'].append((var_name, 'global_var'))
-    
-    return constructs
+    # One parse and one query pass, see extract.py
+    return extract(code, parser).as_constructs()
 
-def create_relations(constructs):
-    G = nx.DiGraph()
+def create_relations(constructs, graph=None):
+    # Any graph with add_node/add_edge works, e.g. compact_graph.CompactGraph for large inputs
+    G = graph if graph is not None else nx.DiGraph()
     
     for construct_type, items in constructs.items():
         for item, item_type in items:
@@ -75,7 +32,7 @@ def create_relations(constructs):
         G.add_edge('module', func_name)
     
     for method_name, _ in constructs['method']:
-        class_name = method_name.split('.')[0]
+        class_name = method_name.rsplit('.', 1)[0]
         G.add_edge(class_name, method_name)
     
     for import_name, _ in constructs['import']:
@@ -86,7 +43,12 @@ def create_relations(constructs):
     
     return G
 
-def visualize_graph(G):
+def visualize_graph(G, output=None, **export_options):
+    # With an output path (.graphml, .dot, .json, .svg, .png) the graph is written headless
+    # with a hierarchical layout; see graph_export.export_graph for the options
+    if output is not None:
+        return export_graph(G, output, **export_options)
+
     pos = nx.spring_layout(G, k=0.9, iterations=50)
     
     node_colors = ['lightblue' if G.nodes[node]['type'] == 'module' else
@@ -175,7 +137,8 @@ if __name__ == "__main__":
 """
 
 
-parser = setup_parser()
-constructs = identify_constructs(code, parser)
-G = create_relations(constructs)
-visualize_graph(G)
\ No newline at end of file
+if __name__ == "__main__":
+    with POOL.parser('python') as parser:
+        constructs = identify_constructs(code, parser)
+    G = create_relations(constructs)
+    visualize_graph(G)
\ No newline at end of file
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import List, Optional
+from tree_sitter import Parser
+from build3 import Span, chunker
+from grammars import REGISTRY, GrammarRegistry
+
+DEFAULT_CACHE_PATH = 'cache/chunks.sqlite'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+FORMAT_VERSION = 1  # bump when the stored span layout changes
+TOUCH_INTERVAL = 3600.0  # a hit only rewrites last_used when it is older than this many seconds
+
+def grammar_version(language: str, registry: GrammarRegistry = REGISTRY) -> str:
+    # Version of the grammar the registry actually loads for the language, wheel or .so
+    try:
+        return registry.version(language)
+    except (KeyError, OSError):
+        return 'unknown'
+
+def cache_key(source_code: bytes, language: str, version: str, MAX_CHARS=512 * 3, coalesce=50) -> str:
+    digest = hashlib.sha256(source_code)
+    digest.update(f'\0{language}\0{version}\0{MAX_CHARS}\0{coalesce}\0{FORMAT_VERSION}'.encode())
+    return digest.hexdigest()
+
+def encode_spans(spans: List[Span]) -> bytes:
+    # Flat starts/ends as little-endian int64s
+    flat = array('q')
+    for span in spans:
+        flat.append(span.start)
+        flat.append(span.end)
+    if sys.byteorder == 'big':
+        flat.byteswap()
+    return flat.tobytes()
+
+def decode_spans(data: bytes) -> List[Span]:
+    flat = array('q')
+    flat.frombytes(data)
+    if sys.byteorder == 'big':
+        flat.byteswap()
+    return [Span(flat[i], flat[i + 1]) for i in range(0, len(flat), 2)]
+
+class ChunkCache:
+    # Content-addressed span cache in SQLite. WAL mode and short IMMEDIATE transactions
+    # let several worker processes share one file; each process opens its own ChunkCache.
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS chunks '
+                        '(key TEXT PRIMARY KEY, spans BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS chunks_last_used ON chunks (last_used)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('total_size', 0)")
+
+    def get(self, key: str) -> Optional[List[Span]]:
+        with self.lock:
+            row = self.db.execute('SELECT spans, last_used FROM chunks WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            # Hits are reads; eviction order only needs last_used to within TOUCH_INTERVAL, so
+            # warm runs don't queue every hit on the write lock
+            now = time.time()
+            if now - row[1] > TOUCH_INTERVAL:
+                self.db.execute('UPDATE chunks SET last_used = ? WHERE key = ?', (now, key))
+        return decode_spans(row[0])
+
+    def put(self, key: str, spans: List[Span]):
+        data = encode_spans(spans)
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute('SELECT size FROM chunks WHERE key = ?', (key,)).fetchone()
+                self.db.execute('INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)', (key, data, len(data), time.time()))
+                self.db.execute("UPDATE meta SET value = value + ? WHERE name = 'total_size'",
+                                (len(data) - (row[0] if row else 0),))
+                self._evict()
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def _evict(self):
+        # Least recently used entries go first until the cache fits again
+        total = self.db.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        evicted = []
+        for key, size in self.db.execute('SELECT key, size FROM chunks ORDER BY last_used'):
+            if total - freed <= self.max_bytes * 0.9:
+                break
+            evicted.append((key,))
+            freed += size
+        self.db.executemany('DELETE FROM chunks WHERE key = ?', evicted)
+        self.db.execute("UPDATE meta SET value = value - ? WHERE name = 'total_size'", (freed,))
+
+    def close(self):
+        self.db.close()
+
+def cached_chunker(
+    cache: ChunkCache,
+    parser: Parser,
+    source_code: bytes,
+    language: str,
+    version: str,
+    MAX_CHARS=512 * 3,
+    coalesce=50
+) -> List[Span]:
+    # A hit returns the stored spans without parsing at all
+    key = cache_key(source_code, language, version, MAX_CHARS, coalesce)
+    spans = cache.get(key)
+    if spans is None:
+        spans = chunker(parser.parse(source_code), source_code, MAX_CHARS, coalesce)
+        cache.put(key, spans)
+    return spans
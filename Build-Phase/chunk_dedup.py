@@ -0,0 +1,222 @@
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from tree_sitter import Parser
+from build3 import Span, chunk_spans
+from line_index import LineIndex
+
+DEFAULT_DEDUP_PATH = 'cache/dedup.sqlite'
+HASH_PRIME = 4294967311  # smallest prime above 2**32, keeps a * x + b inside int64
+
+def normalize(chunk: bytes) -> bytes:
+    # Whitespace-insensitive form, so reindented or reformatted copies hash the same
+    return b' '.join(chunk.split())
+
+def digest(normalized: bytes) -> bytes:
+    return hashlib.blake2b(normalized, digest_size=16).digest()
+
+@dataclass
+class ChunkRef:
+    path: str
+    span: Span
+    digest: bytes
+    kind: str  # "new", "seen" (canonical, stored by an earlier run), "exact" or "near"
+    canonical: Optional[Tuple[str, Span]] = None  # where the first copy lives, None if this is it
+    similarity: float = 1.0  # estimated Jaccard similarity to the canonical chunk for "near"
+
+    @property
+    def is_canonical(self) -> bool:
+        return self.canonical is None
+
+    @property
+    def needs_embedding(self) -> bool:
+        # Only chunks stored for the first time; "seen" ones were embedded when they were new
+        return self.kind == 'new'
+
+class MinHasher:
+    # MinHash signatures over hashed shingles of shingle_size tokens; the permutations come
+    # from a fixed seed so signatures stay comparable across runs
+    def __init__(self, num_perm=64, shingle_size=5, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.int64)
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.int64)
+        self.shingle_size = shingle_size
+
+    def signature(self, normalized: bytes) -> Optional[np.ndarray]:
+        tokens = normalized.split(b' ')
+        if len(tokens) < self.shingle_size:
+            return None
+        shingles = np.fromiter(
+            (zlib.crc32(b' '.join(tokens[i:i + self.shingle_size])) for i in range(len(tokens) - self.shingle_size + 1)),
+            dtype=np.int64)
+        shingles = np.unique(shingles)
+        return ((self.a[:, None] * shingles[None, :] + self.b[:, None]) % HASH_PRIME).min(axis=1)
+
+class ChunkDeduplicator:
+    # Exact duplicates by hash of the normalized chunk, and with near_duplicates a MinHash/LSH
+    # index for chunks whose estimated similarity reaches threshold. Everything lives in SQLite
+    # (in memory with path=':memory:'), so later runs dedupe against earlier ones.
+
+    def __init__(self, path: str = DEFAULT_DEDUP_PATH, near_duplicates=False, threshold=0.8,
+                 num_perm=64, bands=16, shingle_size=5, seed=1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.path = path
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.minhash = MinHasher(num_perm, shingle_size, seed)
+        self.lock = threading.Lock()
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit; writes take BEGIN IMMEDIATE so processes sharing the store serialize
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS chunks (digest BLOB PRIMARY KEY, path TEXT NOT NULL, '
+                        'start INTEGER NOT NULL, end INTEGER NOT NULL, similarity REAL NOT NULL, signature BLOB)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS buckets (band INTEGER NOT NULL, bucket INTEGER NOT NULL, '
+                        'digest BLOB NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, bucket)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS chunks_path ON chunks (path)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        # Signatures are only comparable under the same MinHash parameters
+        params = json.dumps({'num_perm': num_perm, 'bands': bands, 'shingle_size': shingle_size, 'seed': seed})
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('minhash', ?)", (params,))
+        stored = self.db.execute("SELECT value FROM meta WHERE name = 'minhash'").fetchone()[0]
+        if stored != params:
+            raise ValueError(f"{path} was built with MinHash parameters {stored}, not {params}")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def _buckets(self, signature: np.ndarray) -> List[Tuple[int, int]]:
+        # (band, bucket) pairs; chunks sharing any of them are near-duplicate candidates
+        buckets = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            bucket = int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), 'little', signed=True)
+            buckets.append((band, bucket))
+        return buckets
+
+    def _near(self, signature: np.ndarray, buckets: List[Tuple[int, int]]) -> Optional[Tuple[float, tuple]]:
+        candidates: Dict[bytes, None] = {}
+        for band, bucket in buckets:
+            for candidate, in self.db.execute('SELECT digest FROM buckets WHERE band = ? AND bucket = ?',
+                                              (band, bucket)):
+                candidates[candidate] = None
+        best = None
+        for candidate in candidates:
+            row = self.db.execute('SELECT path, start, end, signature FROM chunks WHERE digest = ?',
+                                  (candidate,)).fetchone()
+            similarity = float(np.mean(np.frombuffer(row[3], dtype=np.int64) == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[0]):
+                best = (similarity, row[:3])
+        return best
+
+    def _existing(self, path: str, span: Span, key: bytes) -> Optional[ChunkRef]:
+        row = self.db.execute('SELECT path, start, end, similarity FROM chunks WHERE digest = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[:3] == (path, span.start, span.end):
+            return ChunkRef(path, span, key, 'seen')
+        kind = 'exact' if row[3] == 1.0 else 'near'
+        return ChunkRef(path, span, key, kind, (row[0], Span(row[1], row[2])), row[3])
+
+    def _add(self, path: str, span: Span, chunk: bytes) -> ChunkRef:
+        # Inside a write transaction, so the check and the insert see the same store
+        normalized = normalize(chunk)
+        key = digest(normalized)
+        existing = self._existing(path, span, key)
+        if existing is not None:
+            return existing
+
+        signature = self.minhash.signature(normalized) if self.near_duplicates else None
+        ref = ChunkRef(path, span, key, 'new')
+        if signature is not None:
+            buckets = self._buckets(signature)
+            near = self._near(signature, buckets)
+            if near is not None:
+                similarity, (near_path, start, end) = near
+                ref = ChunkRef(path, span, key, 'near', (near_path, Span(start, end)), similarity)
+        # Near duplicates are recorded under their own digest, pointing at their canonical
+        # chunk with the similarity, so a copy of one resolves in a single lookup
+        location = (ref.canonical[0], ref.canonical[1].start, ref.canonical[1].end) if ref.canonical \
+            else (path, span.start, span.end)
+        inserted = self.db.execute('INSERT OR IGNORE INTO chunks VALUES (?, ?, ?, ?, ?, ?)',
+                                   (key, *location, ref.similarity,
+                                    signature.tobytes() if signature is not None else None)).rowcount
+        if not inserted:
+            # Another writer recorded the same chunk first
+            return self._existing(path, span, key)
+        if signature is not None and ref.canonical is None:
+            self.db.executemany('INSERT INTO buckets VALUES (?, ?, ?)',
+                                [(band, bucket, key) for band, bucket in buckets])
+        return ref
+
+    def add(self, path: str, span: Span, chunk: bytes) -> ChunkRef:
+        with self._transaction():
+            return self._add(path, span, chunk)
+
+    def dedupe(self, path: str, source_code: bytes, spans: List[Span]) -> List[ChunkRef]:
+        # One ChunkRef per byte span from chunk_spans, in one transaction. Refs carry the line
+        # span chunker would give the chunk; chunks covering no whole line are dropped, as
+        # chunker drops them.
+        # The path's rows from an earlier run are replaced, so no canonical location points at
+        # text that has since changed. Chunks that were canonical there before come back as
+        # "seen". Near duplicates elsewhere that pointed into the old file are dropped with them
+        # and get matched again when their own file is deduped.
+        line_index = LineIndex(source_code)
+        refs = []
+        with self._transaction():
+            previous = {key for key, in self.db.execute(
+                'SELECT digest FROM chunks WHERE path = ? AND similarity = 1.0', (path,))}
+            self.db.execute('DELETE FROM buckets WHERE digest IN (SELECT digest FROM chunks WHERE path = ?)', (path,))
+            self.db.execute('DELETE FROM chunks WHERE path = ?', (path,))
+            for span in spans:
+                line_span = Span(line_index.line_number(span.start), line_index.line_number(span.end))
+                if len(line_span) == 0:
+                    continue
+                ref = self._add(path, line_span, source_code[span.start:span.end])
+                if ref.kind == 'new' and ref.digest in previous:
+                    ref.kind = 'seen'
+                refs.append(ref)
+        return refs
+
+    def commit(self):
+        # Writes commit as they go, this only ends a transaction left open
+        with self.lock:
+            if self.db.in_transaction:
+                self.db.execute('COMMIT')
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+def deduped_chunker(
+    dedup: ChunkDeduplicator,
+    parser: Parser,
+    path: str,
+    source_code: bytes,
+    MAX_CHARS=512 * 3,
+    coalesce=50
+) -> List[ChunkRef]:
+    # chunker followed by the dedup stage; only refs with needs_embedding need embedding
+    spans = chunk_spans(parser.parse(source_code), source_code, MAX_CHARS, coalesce)
+    return dedup.dedupe(path, source_code, spans)
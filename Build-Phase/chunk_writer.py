@@ -0,0 +1,253 @@
+import os
+import abc
+import sys
+import json
+import logging
+from dataclasses import dataclass, fields
+from typing import Dict, Iterator, List, Optional
+from build3 import Span, chunk_spans
+from extract import extract
+from language_detection import language_from_path
+from line_index import LineIndex
+from parser_pool import POOL
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_ROWS = 4096  # rows buffered before a batch is written
+BATCH_BYTES = 16 * 1024 * 1024  # or this much chunk text, whichever comes first
+SHARD_ROWS = 1_000_000  # rows per shard before rotating to the next one
+
+@dataclass
+class ChunkRecord:
+    path: str
+    language: str
+    start_byte: int
+    end_byte: int
+    start_line: int  # 1-based line span as chunker returns it
+    end_line: int
+    construct: Optional[str] = None  # qualified name of the enclosing class/function/method
+    construct_kind: Optional[str] = None
+    text: Optional[str] = None
+
+COLUMNS = [f.name for f in fields(ChunkRecord)]
+
+def iter_chunk_records(path: str, source_code: bytes, language: str, MAX_CHARS=512 * 3, coalesce=50,
+                       with_text=False) -> Iterator[ChunkRecord]:
+    # chunker's chunks with their byte ranges too; Python files also get the enclosing construct
+    if language == 'python':
+        extraction = extract(source_code)
+        tree, line_index, enclosing = extraction.tree, extraction.line_index, extraction.enclosing
+    else:
+        with POOL.parser(language) as parser:
+            tree = parser.parse(source_code)
+        line_index, enclosing = LineIndex(source_code), None
+    view = memoryview(source_code)
+    for chunk in chunk_spans(tree, source_code, MAX_CHARS, coalesce):
+        line_chunk = Span(line_index.line_number(chunk.start), line_index.line_number(chunk.end))
+        if len(line_chunk) == 0:
+            continue
+        construct = enclosing(chunk.start, chunk.end) if enclosing is not None else None
+        yield ChunkRecord(
+            path, language, chunk.start, chunk.end, line_chunk.start, line_chunk.end,
+            construct.name if construct else None, construct.kind if construct else None,
+            str(view[chunk.start:chunk.end], 'utf-8', 'replace') if with_text else None)
+
+class ShardedChunkWriter(abc.ABC):
+    # Buffers records column by column and hands full batches to the shard being written.
+    # A shard is written under a temporary name and renamed into place when it is rotated or
+    # the writer closes, so readers only ever see complete shards.
+    extension = ''
+
+    def __init__(self, directory: str, prefix='chunks', batch_rows=BATCH_ROWS, batch_bytes=BATCH_BYTES,
+                 shard_rows=SHARD_ROWS):
+        self.directory = directory
+        self.prefix = prefix
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.shard_rows = shard_rows
+        self.columns: Dict[str, list] = {name: [] for name in COLUMNS}
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+        self.shard = 0
+        self.shard_rows_written = 0
+        self.shards: List[str] = []  # completed shard paths
+        self.temp_path: Optional[str] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def shard_path(self, shard: int) -> str:
+        return os.path.join(self.directory, f'{self.prefix}-{shard:05d}{self.extension}')
+
+    def write(self, record: ChunkRecord):
+        for name in COLUMNS:
+            self.columns[name].append(getattr(record, name))
+        self.buffered_rows += 1
+        if record.text is not None:
+            # The text's size in the source, in bytes like BATCH_BYTES, not characters
+            self.buffered_bytes += record.end_byte - record.start_byte
+        if self.buffered_rows >= self.batch_rows or self.buffered_bytes >= self.batch_bytes:
+            self.flush()
+
+    def write_all(self, records: Iterator[ChunkRecord]) -> int:
+        count = 0
+        for record in records:
+            self.write(record)
+            count += 1
+        return count
+
+    def flush(self):
+        if not self.buffered_rows:
+            return
+        if self.temp_path is None:
+            self.temp_path = os.path.join(self.directory, f'.{self.prefix}-{self.shard:05d}{self.extension}.tmp')
+            self._open(self.temp_path)
+        self._write_batch(self.columns, self.buffered_rows)
+        self.shard_rows_written += self.buffered_rows
+        self.columns = {name: [] for name in COLUMNS}
+        self.buffered_rows = self.buffered_bytes = 0
+        if self.shard_rows_written >= self.shard_rows:
+            self.rotate()
+
+    def rotate(self):
+        if self.temp_path is None:
+            return
+        self._close()
+        path = self.shard_path(self.shard)
+        os.replace(self.temp_path, path)
+        self.shards.append(path)
+        self.temp_path = None
+        self.shard += 1
+        self.shard_rows_written = 0
+
+    def close(self) -> List[str]:
+        self.flush()
+        self.rotate()
+        return self.shards
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.temp_path is not None:
+            # A failed run leaves the shards it completed and drops the partial one
+            self._close()
+            os.unlink(self.temp_path)
+            self.temp_path = None
+
+    @abc.abstractmethod
+    def _open(self, path: str):
+        ...
+
+    @abc.abstractmethod
+    def _write_batch(self, columns: Dict[str, list], rows: int):
+        ...
+
+    @abc.abstractmethod
+    def _close(self):
+        ...
+
+class JsonLinesChunkWriter(ShardedChunkWriter):
+    extension = '.jsonl'
+
+    def _open(self, path: str):
+        self.file = open(path, 'w', encoding='utf8')
+
+    def _write_batch(self, columns: Dict[str, list], rows: int):
+        # One write per batch
+        values = [columns[name] for name in COLUMNS]
+        self.file.write(''.join(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n'
+                                for row in zip(*values)))
+
+    def _close(self):
+        self.file.close()
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ImportError("Arrow and Parquet output need pyarrow (pip install pyarrow); "
+                          "JsonLinesChunkWriter works without it") from None
+
+def arrow_schema(pa):
+    return pa.schema([
+        ('path', pa.string()), ('language', pa.string()),
+        ('start_byte', pa.int64()), ('end_byte', pa.int64()),
+        ('start_line', pa.int64()), ('end_line', pa.int64()),
+        ('construct', pa.string()), ('construct_kind', pa.string()),
+        ('text', pa.large_string()),
+    ])
+
+class ParquetChunkWriter(ShardedChunkWriter):
+    # One row group per batch, dictionary-encoded path/language columns compress well
+    extension = '.parquet'
+
+    def __init__(self, directory: str, compression='zstd', **kwargs):
+        self.pa = _pyarrow()
+        self.schema = arrow_schema(self.pa)
+        self.compression = compression
+        super().__init__(directory, **kwargs)
+
+    def _open(self, path: str):
+        self.writer = self.pa.parquet.ParquetWriter(path, self.schema, compression=self.compression)
+
+    def _write_batch(self, columns: Dict[str, list], rows: int):
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def _close(self):
+        self.writer.close()
+
+class ArrowChunkWriter(ShardedChunkWriter):
+    # Arrow IPC files, one record batch per batch
+    extension = '.arrow'
+
+    def __init__(self, directory: str, **kwargs):
+        self.pa = _pyarrow()
+        self.schema = arrow_schema(self.pa)
+        super().__init__(directory, **kwargs)
+
+    def _open(self, path: str):
+        self.sink = self.pa.OSFile(path, 'wb')
+        self.writer = self.pa.ipc.new_file(self.sink, self.schema)
+
+    def _write_batch(self, columns: Dict[str, list], rows: int):
+        self.writer.write_batch(self.pa.RecordBatch.from_pydict(columns, schema=self.schema))
+
+    def _close(self):
+        self.writer.close()
+        self.sink.close()
+
+WRITERS = {'jsonl': JsonLinesChunkWriter, 'parquet': ParquetChunkWriter, 'arrow': ArrowChunkWriter}
+
+def write_repository(root: str, directory: str, format='jsonl', with_text=False, MAX_CHARS=512 * 3,
+                     coalesce=50, **kwargs) -> List[str]:
+    # Chunks every source file under root into shards in directory; returns the shard paths
+    from repo_chunker import iter_source_files
+    with WRITERS[format](directory, **kwargs) as writer:
+        for path in iter_source_files(root):
+            language = language_from_path(path)
+            if language is None or not POOL.grammars.is_available(language):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    source_code = f.read()
+                # Collected first, so a file that fails partway leaves nothing in the shard
+                records = list(iter_chunk_records(path, source_code, language, MAX_CHARS, coalesce, with_text))
+            except Exception as e:
+                logger.warning(f"Failed to chunk {path}: {e}")
+                continue
+            writer.write_all(records)
+    return writer.shards
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else '.'
+    directory = sys.argv[2] if len(sys.argv) > 2 else 'cache/chunks'
+    format = sys.argv[3] if len(sys.argv) > 3 else 'jsonl'
+    for shard in write_repository(root, directory, format, with_text=True):
+        print(shard)
+
+if __name__ == "__main__":
+    main()
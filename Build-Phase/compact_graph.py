@@ -0,0 +1,205 @@
+from array import array
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+import networkx as nx
+
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+def _storage(value) -> str:
+    # How a column whose values are all like this one can be stored
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, int) and not isinstance(value, bool) and INT64_MIN <= value <= INT64_MAX:
+        return 'int'
+    return 'object'
+
+class _Column:
+    # One node or edge attribute: ints stored as-is, strings interned into a table, anything
+    # else (or a mix of types) as plain objects. Which positions hold a value is kept in a
+    # separate mask, so every value, -1 and None included, reads back as it was written.
+    def __init__(self, storage: str):
+        self.storage = storage
+        self.values = array('q') if storage != 'object' else []
+        self.present = bytearray()
+        self.table: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def _to_objects(self):
+        self.values = [self.get(position) for position in range(len(self.values))]
+        self.storage = 'object'
+        self.table, self.index = [], {}
+
+    def set(self, position: int, value):
+        if self.storage != 'object' and _storage(value) != self.storage:
+            self._to_objects()
+        if self.storage == 'string':
+            code = self.index.get(value)
+            if code is None:
+                code = self.index[value] = len(self.table)
+                self.table.append(value)
+            value = code
+        if position >= len(self.values):
+            missing = position + 1 - len(self.values)
+            self.values.extend([0 if self.storage != 'object' else None] * missing)
+            self.present.extend(bytes(missing))
+        self.values[position] = value
+        self.present[position] = 1
+
+    def has(self, position: int) -> bool:
+        return position < len(self.present) and self.present[position] == 1
+
+    def get(self, position: int, default=None):
+        if not self.has(position):
+            return default
+        value = self.values[position]
+        return self.table[value] if self.storage == 'string' else value
+
+    def matches(self, positions: np.ndarray, value) -> np.ndarray:
+        # Which of the positions hold `value`
+        in_range = positions < len(self.present)
+        mask = np.zeros(len(positions), dtype=bool)
+        inside = positions[in_range]
+        if self.storage == 'object':
+            mask[in_range] = [self.has(position) and self.values[position] == value
+                              for position in inside.tolist()]
+            return mask
+        if self.storage == 'string':
+            code = self.index.get(value) if isinstance(value, str) else None
+        else:
+            code = value if _storage(value) == 'int' else None
+        if code is None:
+            return mask
+        present = np.frombuffer(self.present, dtype=np.uint8)[inside] == 1
+        mask[in_range] = present & (np.frombuffer(self.values, dtype=np.int64)[inside] == code)
+        return mask
+
+class CompactGraph:
+    # Directed graph with node ids interned to integers, node attributes in typed columns and
+    # edges in CSR adjacency (built on first query). Supports the add_node/add_edge/has_node
+    # calls the graph builders make, so it can be passed wherever they take a graph.
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.columns: Dict[str, _Column] = {}
+        self.edge_columns: Dict[str, _Column] = {}
+        self.sources = array('q')
+        self.targets = array('q')
+        self.edge_ids: Dict[int, int] = {}  # source << 32 | target -> edge, to merge repeated edges
+        self._csr = None
+
+    def _intern(self, node_id: str) -> int:
+        position = self.positions.get(node_id)
+        if position is None:
+            position = self.positions[node_id] = len(self.ids)
+            self.ids.append(node_id)
+        return position
+
+    @staticmethod
+    def _set_attrs(columns: Dict[str, _Column], position: int, attrs: dict):
+        for name, value in attrs.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = _Column(_storage(value))
+            column.set(position, value)
+
+    def add_node(self, node_id: str, **attrs):
+        self._set_attrs(self.columns, self._intern(node_id), attrs)
+
+    def add_edge(self, source: str, target: str, **attrs):
+        # Adding an edge again updates its attributes, as nx.DiGraph.add_edge does
+        source_position, target_position = self._intern(source), self._intern(target)
+        key = source_position << 32 | target_position
+        edge = self.edge_ids.get(key)
+        if edge is None:
+            edge = self.edge_ids[key] = len(self.sources)
+            self.sources.append(source_position)
+            self.targets.append(target_position)
+            self._csr = None
+        self._set_attrs(self.edge_columns, edge, attrs)
+
+    def has_node(self, node_id: str) -> bool:
+        return node_id in self.positions
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    def number_of_nodes(self) -> int:
+        return len(self.ids)
+
+    def number_of_edges(self) -> int:
+        return len(self.sources)
+
+    def node_attrs(self, node_id: str) -> dict:
+        position = self.positions[node_id]
+        return {name: column.get(position) for name, column in self.columns.items() if column.has(position)}
+
+    def edge_attrs(self, edge: int) -> dict:
+        return {name: column.get(edge) for name, column in self.edge_columns.items() if column.has(edge)}
+
+    def _adjacency(self):
+        # (indptr, targets, edge ids) sorted by source, and the same by target for reverse lookups.
+        # add_edge keeps one edge per (source, target) pair, as in nx.DiGraph.
+        if self._csr is None:
+            n = len(self.ids)
+            sources = np.frombuffer(self.sources, dtype=np.int64)
+            targets = np.frombuffer(self.targets, dtype=np.int64)
+            edges = np.arange(len(sources))
+            order = edges[np.argsort(sources[edges], kind='stable')]
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(sources[order], minlength=n), out=indptr[1:])
+            reverse = edges[np.argsort(targets[edges], kind='stable')]
+            reverse_indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(targets[reverse], minlength=n), out=reverse_indptr[1:])
+            self._csr = (indptr, targets[order], order, reverse_indptr, sources[reverse], reverse)
+        return self._csr
+
+    def _neighbors(self, position: int, reverse: bool, kind: Optional[str]) -> np.ndarray:
+        indptr, neighbors, edges = self._adjacency()[3:] if reverse else self._adjacency()[:3]
+        found = neighbors[indptr[position]:indptr[position + 1]]
+        if kind is not None and 'kind' in self.edge_columns:
+            found = found[self.edge_columns['kind'].matches(edges[indptr[position]:indptr[position + 1]], kind)]
+        return found
+
+    def successors(self, node_id: str, kind: Optional[str] = None) -> List[str]:
+        return [self.ids[i] for i in self._neighbors(self.positions[node_id], False, kind).tolist()]
+
+    def predecessors(self, node_id: str, kind: Optional[str] = None) -> List[str]:
+        return [self.ids[i] for i in self._neighbors(self.positions[node_id], True, kind).tolist()]
+
+    def _reachable(self, node_id: str, reverse: bool, kind: Optional[str]) -> List[str]:
+        seen = np.zeros(len(self.ids), dtype=bool)
+        start = self.positions[node_id]
+        seen[start] = True
+        frontier = [start]
+        found = []
+        while frontier:
+            position = frontier.pop()
+            for neighbor in self._neighbors(position, reverse, kind).tolist():
+                if not seen[neighbor]:
+                    seen[neighbor] = True
+                    found.append(neighbor)
+                    frontier.append(neighbor)
+        return [self.ids[i] for i in found]
+
+    def descendants(self, node_id: str, kind: Optional[str] = None) -> List[str]:
+        return self._reachable(node_id, False, kind)
+
+    def ancestors(self, node_id: str, kind: Optional[str] = None) -> List[str]:
+        return self._reachable(node_id, True, kind)
+
+    def edges(self) -> Iterator[tuple]:
+        indptr, targets, edges = self._adjacency()[:3]
+        sources = np.repeat(np.arange(len(self.ids)), np.diff(indptr))
+        for source, target, edge in zip(sources.tolist(), targets.tolist(), edges.tolist()):
+            yield self.ids[source], self.ids[target], self.edge_attrs(edge)
+
+    def to_networkx(self) -> nx.DiGraph:
+        G = nx.DiGraph()
+        for node_id in self.ids:
+            G.add_node(node_id, **self.node_attrs(node_id))
+        G.add_edges_from(self.edges())
+        return G
@@ -0,0 +1,164 @@
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+from tree_sitter import Node, Tree
+from build3 import Span, chunk_spans
+from line_index import LineIndex
+from parser_pool import POOL
+
+# Everything build4, build6 and build7 look for, in one query
+CONSTRUCTS_QUERY = """
+(module) @module
+(class_definition
+  name: (identifier) @class.name
+  body: (block) @class.body) @class
+(function_definition
+  name: (identifier) @function.name
+  body: (block) @function.body) @function
+(import_statement) @import
+(import_from_statement) @import_from
+(assignment
+  left: (identifier) @global_var
+  right: (_)) @global_assignment
+"""
+KINDS = ['module', 'class', 'function', 'method', 'import', 'global_var']
+
+@dataclass
+class Construct:
+    kind: str  # one of KINDS
+    name: str  # qualified inside the file, e.g. "DataProcessor.process"
+    start_byte: int
+    end_byte: int
+    start_line: int  # 1-based like the chunker's line spans
+    end_line: int
+    parent: Optional[str] = None  # qualified name of the enclosing class or function
+    body_start_byte: Optional[int] = None
+    body_end_byte: Optional[int] = None
+
+    def extract(self, source_code: bytes) -> bytes:
+        return source_code[self.start_byte:self.end_byte]
+
+    def body(self, source_code: bytes) -> Optional[bytes]:
+        if self.body_start_byte is None:
+            return None
+        return source_code[self.body_start_byte:self.body_end_byte]
+
+@dataclass
+class Extraction:
+    source_code: bytes
+    tree: Tree
+    line_index: LineIndex
+    constructs: List[Construct] = field(default_factory=list)  # in source order
+
+    def of_kind(self, *kinds: str) -> List[Construct]:
+        return [construct for construct in self.constructs if construct.kind in kinds]
+
+    @cached_property
+    def scopes(self) -> List[Construct]:
+        return self.of_kind('class', 'function', 'method')
+
+    @cached_property
+    def scope_starts(self) -> List[int]:
+        return [scope.start_byte for scope in self.scopes]
+
+    @cached_property
+    def scope_parents(self) -> List[int]:
+        # Index of the scope each scope is nested in, -1 at the top, from one sweep with a stack
+        parents = []
+        stack: List[int] = []
+        for i, scope in enumerate(self.scopes):
+            while stack and self.scopes[stack[-1]].end_byte < scope.end_byte:
+                stack.pop()
+            parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+        return parents
+
+    def enclosing(self, start_byte: int, end_byte: int) -> Optional[Construct]:
+        # Innermost class, function or method containing the whole range. Scopes nest, so it is
+        # the last scope starting at or before the range or one of that scope's parents.
+        i = bisect_right(self.scope_starts, start_byte) - 1
+        while i >= 0 and self.scopes[i].end_byte < end_byte:
+            i = self.scope_parents[i]
+        return self.scopes[i] if i >= 0 else None
+
+    def chunks(self, MAX_CHARS=512 * 3, coalesce=50) -> List[Tuple[Span, Optional[Construct]]]:
+        # chunker's line spans, each with the construct it falls in, from the tree parsed here
+        chunks = []
+        for chunk in chunk_spans(self.tree, self.source_code, MAX_CHARS, coalesce):
+            line_chunk = Span(self.line_index.line_number(chunk.start), self.line_index.line_number(chunk.end))
+            if len(line_chunk) > 0:
+                chunks.append((line_chunk, self.enclosing(chunk.start, chunk.end)))
+        return chunks
+
+    def as_constructs(self) -> Dict[str, List[Tuple[str, str]]]:
+        # The {kind: [(name, kind), ...]} shape that build7's create_relations reads
+        constructs: Dict[str, List[Tuple[str, str]]] = {kind: [] for kind in KINDS}
+        for construct in self.constructs:
+            constructs[construct.kind].append((construct.name, construct.kind))
+        return constructs
+
+def _text(node: Node, source_code: bytes) -> str:
+    return source_code[node.start_byte:node.end_byte].decode('utf8', 'replace')
+
+def _import_names(node: Node, source_code: bytes) -> List[str]:
+    if node.type == 'import_from_statement':
+        module = node.child_by_field_name('module_name')
+        return [_text(module, source_code)] if module else []
+    names = []
+    for name in node.children_by_field_name('name'):
+        if name.type == 'aliased_import':
+            name = name.child_by_field_name('name')
+        names.append(_text(name, source_code))
+    return names
+
+def extract(code, parser=None) -> Extraction:
+    # One parse and one query pass for every construct the chunker, graph builders and
+    # method printer need
+    source_code = code if isinstance(code, bytes) else bytes(code, "utf8")
+    if parser is None:
+        with POOL.parser('python') as parser:
+            tree = parser.parse(source_code)
+            language = parser.language
+    else:
+        tree = parser.parse(source_code)
+        language = parser.language
+    line_index = LineIndex(source_code)
+    extraction = Extraction(source_code, tree, line_index)
+
+    def add(kind: str, name: str, node: Node, parent: Optional[str], body: Optional[Node] = None) -> Construct:
+        construct = Construct(kind, name, node.start_byte, node.end_byte,
+                              node.start_point[0] + 1, node.end_point[0] + 1, parent)
+        if body is not None:
+            construct.body_start_byte, construct.body_end_byte = body.start_byte, body.end_byte
+        extraction.constructs.append(construct)
+        return construct
+
+    # Open classes and functions as (end_byte, construct); captures arrive in source order
+    scopes: List[Tuple[int, Construct]] = []
+    for node, capture_name in POOL.query(language, CONSTRUCTS_QUERY).captures(tree.root_node):
+        while scopes and scopes[-1][0] <= node.start_byte:
+            scopes.pop()
+        parent = scopes[-1][1] if scopes else None
+        if capture_name == 'module':
+            add('module', 'module', node, None)
+        elif capture_name in ('class', 'function'):
+            name = _text(node.child_by_field_name('name'), source_code)
+            if capture_name == 'class':
+                kind = 'class'
+            else:
+                kind = 'method' if parent is not None and parent.kind == 'class' else 'function'
+            qualified_name = f"{parent.name}.{name}" if parent is not None else name
+            construct = add(kind, qualified_name, node, parent.name if parent else None,
+                            node.child_by_field_name('body'))
+            scopes.append((node.end_byte, construct))
+        elif capture_name in ('import', 'import_from'):
+            for name in _import_names(node, source_code):
+                add('import', name, node, parent.name if parent else None)
+        elif capture_name == 'global_assignment':
+            # Only assignments made at module level are globals
+            statement = node.parent
+            if statement is not None and statement.type == 'expression_statement' \
+                and statement.parent is not None and statement.parent.type == 'module':
+                add('global_var', _text(node.child_by_field_name('left'), source_code), node, None)
+    return extraction
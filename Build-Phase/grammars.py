@@ -0,0 +1,125 @@
+import os
+import ctypes
+import logging
+import subprocess
+import threading
+import importlib
+import importlib.util
+from importlib import metadata
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Sequence
+from tree_sitter import Language
+
+logger = logging.getLogger(__name__)
+
+LANGUAGE_NAMES = ["python", "java", "cpp", "go", "rust", "ruby", "php"]
+# Prebuilt grammars shipped next to the code, then whatever an earlier build left in the cache
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vendor')
+SEARCH_DIRS = [VENDOR_DIR, 'cache/build']
+
+def _stat_version(path: str) -> str:
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+class GrammarRegistry(Mapping):
+    # Lazily loaded Language objects, one per grammar, from an installed tree_sitter_<lang>
+    # wheel or a prebuilt <lang>.so. Nothing is cloned or compiled.
+
+    def __init__(self, names: Sequence[str] = LANGUAGE_NAMES, search_dirs: Optional[Sequence[str]] = None):
+        self.names: List[str] = list(names)
+        self.search_dirs: List[str] = list(search_dirs if search_dirs is not None else SEARCH_DIRS)
+        self.loaded: Dict[str, Language] = {}
+        self.versions: Dict[str, str] = {}  # what each loaded grammar came from, see version()
+        self.available: Dict[str, bool] = {}
+        self.lock = threading.Lock()
+
+    def _shared_object(self, name: str) -> Optional[str]:
+        for directory in self.search_dirs:
+            path = os.path.join(directory, f'{name}.so')
+            if os.path.exists(path):
+                return path
+        return None
+
+    def is_available(self, name: str) -> bool:
+        # True once the grammar has actually loaded; a failed load is remembered too
+        if name not in self.available:
+            if name not in self.names or (importlib.util.find_spec(f'tree_sitter_{name}') is None
+                                          and self._shared_object(name) is None):
+                self.available[name] = False
+            else:
+                try:
+                    self[name]
+                except Exception as e:
+                    logger.warning(f"Could not load grammar {name}: {e}")
+                    self.available[name] = False
+        return self.available[name]
+
+    def load(self, name: str) -> Language:
+        try:
+            module = importlib.import_module(f'tree_sitter_{name}')
+        except ImportError:
+            module = None
+        if module is not None:
+            # Most wheels export language(), a few (php, typescript) name it after the dialect
+            language_function = getattr(module, 'language', None) or getattr(module, f'language_{name}')
+            try:
+                self.versions[name] = f'tree-sitter-{name} {metadata.version(f"tree-sitter-{name}")}'
+            except metadata.PackageNotFoundError:
+                self.versions[name] = f'{module.__file__} {_stat_version(module.__file__)}'
+            return Language(language_function())
+        path = self._shared_object(name)
+        if path is not None:
+            # tree-sitter takes a pointer to the TSLanguage that tree_sitter_<name>() returns
+            language_function = getattr(ctypes.cdll.LoadLibrary(os.path.abspath(path)), f'tree_sitter_{name}')
+            language_function.restype = ctypes.c_void_p
+            self.versions[name] = f'{os.path.abspath(path)} {_stat_version(path)}'
+            return Language(language_function())
+        raise KeyError(f"No tree_sitter_{name} package or prebuilt {name}.so in {self.search_dirs}")
+
+    def version(self, name: str) -> str:
+        # Identifies the grammar actually loaded for name: its wheel's version, or the path, size
+        # and mtime of the shared object, so swapping either changes it
+        self[name]
+        return self.versions[name]
+
+    def __getitem__(self, name: str) -> Language:
+        language = self.loaded.get(name)
+        if language is not None:
+            return language
+        if name not in self.names:
+            raise KeyError(name)
+        with self.lock:
+            if name not in self.loaded:
+                self.loaded[name] = self.load(name)
+                self.available[name] = True
+                logger.debug(f"Loaded grammar {name}")
+            return self.loaded[name]
+
+    def __contains__(self, name) -> bool:
+        return self.is_available(name)
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name in self.names if self.is_available(name))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+def build_shared_object(name: str, repository: str, output_dir='cache/build') -> str:
+    # Compiles a grammar checkout's generated parser (and external scanner, if it has one) into
+    # <output_dir>/<name>.so, one of the places the registry looks
+    source_dir = os.path.join(repository, name, 'src')  # php keeps its grammar in a subdirectory
+    if not os.path.isdir(source_dir):
+        source_dir = os.path.join(repository, 'src')
+    sources = [os.path.join(source_dir, file) for file in ('parser.c', 'scanner.c', 'scanner.cc')
+               if os.path.exists(os.path.join(source_dir, file))]
+    compiler = 'c++' if any(source.endswith('.cc') for source in sources) else 'cc'
+    os.makedirs(output_dir, exist_ok=True)
+    output = os.path.join(output_dir, f'{name}.so')
+    subprocess.run([compiler, '-shared', '-fPIC', '-O2', '-I', source_dir, '-o', output, *sources], check=True)
+    return output
+
+# One registry, and so one Language per grammar, for the whole process
+REGISTRY = GrammarRegistry()
+
+def get_language(name: str) -> Language:
+    return REGISTRY[name]
@@ -0,0 +1,216 @@
+import os
+import json
+from collections import Counter, defaultdict
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Tuple
+import networkx as nx
+
+TYPE_COLORS = {
+    'module': 'lightblue',
+    'class': 'lightgreen',
+    'method': 'pink',
+    'function': 'yellow',
+    'import': 'orange',
+    'external': 'orange',
+    'global_var': 'lightgrey',
+}
+MAX_FIGURE_INCHES = 50
+RENDER_MAX_NODES = 20000  # images of bigger graphs are aggregated first
+LABEL_LIMIT = 200  # above this many nodes labels are left out of rendered images
+
+def iter_nodes(G) -> Iterator[Tuple[str, dict]]:
+    # Works for nx graphs and compact_graph.CompactGraph alike
+    if isinstance(G, nx.Graph):
+        yield from G.nodes(data=True)
+    else:
+        for node_id in G.ids:
+            yield node_id, G.node_attrs(node_id)
+
+def iter_edges(G) -> Iterator[Tuple[str, str, dict]]:
+    if isinstance(G, nx.Graph):
+        yield from G.edges(data=True)
+    else:
+        yield from G.edges()
+
+def _is_hierarchy(attrs: dict) -> bool:
+    # Graphs from build6/build7 only have containment edges and carry no kind
+    return attrs.get('kind', 'contains') == 'contains'
+
+def hierarchy(G) -> Tuple[Dict[str, str], List[str]]:
+    # Parent of every node along module -> class -> method edges, and the roots in input order
+    parents: Dict[str, str] = {}
+    for source, target, attrs in iter_edges(G):
+        if _is_hierarchy(attrs) and target not in parents:
+            parents[target] = source
+    roots = [node_id for node_id, _ in iter_nodes(G) if node_id not in parents]
+    return parents, roots
+
+def hierarchical_layout(G) -> Dict[str, Tuple[float, float]]:
+    # Layered tree layout in linear time: leaves get consecutive x positions, parents sit
+    # centred over their children and depth goes downwards
+    parents, roots = hierarchy(G)
+    children: Dict[str, List[str]] = defaultdict(list)
+    for child, parent in parents.items():
+        children[parent].append(child)
+    pos: Dict[str, Tuple[float, float]] = {}
+    seen = set()
+    next_x = 0.0
+    # Nodes on containment cycles have no root above them, so they start trees of their own
+    for root in chain(roots, (node_id for node_id, _ in iter_nodes(G))):
+        if root in seen:
+            continue
+        seen.add(root)
+        # Post-order with an explicit stack so deep hierarchies are fine
+        stack = [(root, 0, False)]
+        while stack:
+            node_id, depth, expanded = stack.pop()
+            kids = [kid for kid in children.get(node_id, []) if kid not in seen]
+            if expanded or not kids:
+                placed = [pos[kid][0] for kid in children.get(node_id, []) if kid in pos]
+                if placed:
+                    x = (min(placed) + max(placed)) / 2
+                else:
+                    x, next_x = next_x, next_x + 1
+                pos[node_id] = (x, -float(depth))
+            else:
+                seen.update(kids)
+                stack.append((node_id, depth, True))
+                stack.extend((kid, depth + 1, False) for kid in reversed(kids))
+    return pos
+
+def depths(parents: Dict[str, str], roots: List[str]) -> Dict[str, int]:
+    children: Dict[str, List[str]] = defaultdict(list)
+    for child, parent in parents.items():
+        children[parent].append(child)
+    depth = {root: 0 for root in roots}
+    frontier = list(roots)
+    while frontier:
+        node_id = frontier.pop()
+        for child in children.get(node_id, []):
+            if child not in depth:
+                depth[child] = depth[node_id] + 1
+                frontier.append(child)
+    return depth
+
+def fit_depth(G, max_nodes: int) -> int:
+    # Deepest hierarchy level that can be kept with at most max_nodes nodes (roots are always kept)
+    parents, roots = hierarchy(G)
+    per_depth = Counter(depths(parents, roots).values())
+    kept, depth = 0, 0
+    while depth in per_depth:
+        kept += per_depth[depth]
+        if kept > max_nodes:
+            return max(depth - 1, 0)
+        depth += 1
+    return depth
+
+def aggregate(G, max_depth: int) -> nx.DiGraph:
+    # Collapses everything below max_depth in the hierarchy into its ancestor at that depth,
+    # which keeps a "collapsed" count; other edges are redirected to the surviving nodes
+    parents, roots = hierarchy(G)
+    depth = depths(parents, roots)
+    kept: Dict[str, str] = {}
+
+    def representative(node_id: str) -> str:
+        found = kept.get(node_id)
+        if found is None:
+            found = node_id
+            while depth.get(found, 0) > max_depth:
+                found = parents[found]
+            kept[node_id] = found
+        return found
+
+    A = nx.DiGraph()
+    collapsed: Dict[str, int] = defaultdict(int)
+    for node_id, attrs in iter_nodes(G):
+        if representative(node_id) == node_id:
+            A.add_node(node_id, **attrs)
+        else:
+            collapsed[representative(node_id)] += 1
+    for node_id, count in collapsed.items():
+        A.nodes[node_id]['collapsed'] = count
+    for source, target, attrs in iter_edges(G):
+        source, target = representative(source), representative(target)
+        if source != target:
+            A.add_edge(source, target, **attrs)
+    return A
+
+def _dot_id(value) -> str:
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def write_dot(G, path: str):
+    with open(path, 'w', encoding='utf8', buffering=1024 * 1024) as f:
+        f.write('digraph code_structure {\n  rankdir=TB;\n  node [shape=box, style=filled];\n')
+        for node_id, attrs in iter_nodes(G):
+            color = TYPE_COLORS.get(attrs.get('type'), 'white')
+            fields = ''.join(f', {key}={_dot_id(value)}' for key, value in attrs.items())
+            f.write(f'  {_dot_id(node_id)} [fillcolor={_dot_id(color)}{fields}];\n')
+        for source, target, attrs in iter_edges(G):
+            fields = ', '.join(f'{key}={_dot_id(value)}' for key, value in attrs.items())
+            f.write(f'  {_dot_id(source)} -> {_dot_id(target)}' + (f' [{fields}]' if fields else '') + ';\n')
+        f.write('}\n')
+
+def write_json(G, path: str):
+    with open(path, 'w', encoding='utf8', buffering=1024 * 1024) as f:
+        json.dump({
+            'directed': True,
+            'nodes': [dict(attrs, id=node_id) for node_id, attrs in iter_nodes(G)],
+            'edges': [dict(attrs, source=source, target=target) for source, target, attrs in iter_edges(G)],
+        }, f)
+
+def render(G, path: str, title: str = "Code Structure Graph"):
+    # Headless drawing: one scatter for the nodes and one LineCollection for the edges, on a
+    # Figure with its own Agg canvas, so pyplot and the process's backend are left alone
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Rectangle
+
+    pos = hierarchical_layout(G)
+    nodes = list(iter_nodes(G))
+    width = min(MAX_FIGURE_INCHES, max(12, len(pos) ** 0.5 / 4))
+    fig = Figure(figsize=(width, max(8, width / 3)))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    base_size = 300 if len(nodes) <= LABEL_LIMIT else 20
+    segments = [(pos[source], pos[target]) for source, target, _ in iter_edges(G)]
+    ax.add_collection(LineCollection(segments, colors='grey', linewidths=0.5, alpha=0.5))
+    ax.scatter([pos[node_id][0] for node_id, _ in nodes], [pos[node_id][1] for node_id, _ in nodes],
+               c=[TYPE_COLORS.get(attrs.get('type'), 'white') for _, attrs in nodes],
+               s=[base_size + 5 * attrs.get('collapsed', 0) ** 0.5 for _, attrs in nodes],
+               edgecolors='black', linewidths=0.2, zorder=2)
+    if len(nodes) <= LABEL_LIMIT:
+        for node_id, attrs in nodes:
+            label = node_id if 'collapsed' not in attrs else f"{node_id} (+{attrs['collapsed']})"
+            ax.annotate(label, pos[node_id], fontsize=6, ha='center', va='bottom')
+    present = {attrs.get('type') for _, attrs in nodes}
+    legend_elements = [Rectangle((0, 0), 1, 1, fc=color, label=node_type.replace('_', ' ').title())
+                       for node_type, color in TYPE_COLORS.items() if node_type in present]
+    ax.legend(handles=legend_elements, loc='upper right')
+    ax.set_title(title)
+    ax.axis('off')
+    ax.autoscale()
+    fig.tight_layout()
+    fig.savefig(path)
+
+def export_graph(G, path: str, format: Optional[str] = None, max_nodes: Optional[int] = None,
+                 collapse_depth: Optional[int] = None):
+    # Format comes from the extension: .graphml, .dot, .json, .svg, .png or .pdf. Graphs with
+    # more than max_nodes nodes (RENDER_MAX_NODES for images) are first aggregated below
+    # collapse_depth, by default the deepest module -> class -> method level that fits.
+    format = (format or os.path.splitext(path)[1].lstrip('.')).lower()
+    if max_nodes is None and format in ('svg', 'png', 'pdf'):
+        max_nodes = RENDER_MAX_NODES
+    if max_nodes is not None and G.number_of_nodes() > max_nodes:
+        G = aggregate(G, collapse_depth if collapse_depth is not None else fit_depth(G, max_nodes))
+    if format == 'graphml':
+        nx.write_graphml(G if isinstance(G, nx.Graph) else G.to_networkx(), path)
+    elif format in ('dot', 'gv'):
+        write_dot(G, path)
+    elif format == 'json':
+        write_json(G, path)
+    elif format in ('svg', 'png', 'pdf'):
+        render(G, path)
+    else:
+        raise ValueError(f"Unknown graph export format: {format}")
+    return path
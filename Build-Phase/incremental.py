@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from tree_sitter import Parser, Tree, Node
+from build3 import Span, chunk_children, fill_gaps, coalesce_chunks, is_coalesced, chunk_spans
+from line_index import LineIndex
+from traversal import iter_children
+
+@dataclass
+class Edit:
+    start_byte: int
+    old_end_byte: int
+    replacement: bytes
+
+    @property
+    def new_end_byte(self) -> int:
+        return self.start_byte + len(self.replacement)
+
+    @property
+    def delta(self) -> int:
+        return self.new_end_byte - self.old_end_byte
+
+    def apply(self, source_code: bytes) -> bytes:
+        return source_code[:self.start_byte] + self.replacement + source_code[self.old_end_byte:]
+
+def _point(source_code: bytes, byte_offset: int, row: int, row_start: int) -> Tuple[int, int]:
+    # Point of byte_offset, counting newlines on from a known row starting at row_start
+    row += source_code.count(b'\n', row_start, byte_offset)
+    last_newline = source_code.rfind(b'\n', row_start, byte_offset)
+    return row, byte_offset - (last_newline + 1 if last_newline != -1 else row_start)
+
+def edit_tree(tree: Tree, source_code: bytes, edit: Edit, line_index: Optional[LineIndex] = None):
+    # Tree.edit wants points as well as bytes, both for the old and the new text. Without a
+    # line index the points come from counting newlines, nothing is built over the whole file.
+    if line_index is not None:
+        start_point = line_index.point(edit.start_byte)
+        old_end_point = line_index.point(edit.old_end_byte)
+    else:
+        start_point = _point(source_code, edit.start_byte, 0, 0)
+        row_start = edit.start_byte - start_point[1]
+        old_end_point = _point(source_code, edit.old_end_byte, start_point[0], row_start)
+    newlines = edit.replacement.count(b'\n')
+    if newlines:
+        new_end_point = (start_point[0] + newlines, len(edit.replacement) - edit.replacement.rfind(b'\n') - 1)
+    else:
+        new_end_point = (start_point[0], start_point[1] + len(edit.replacement))
+    tree.edit(
+        start_byte=edit.start_byte,
+        old_end_byte=edit.old_end_byte,
+        new_end_byte=edit.new_end_byte,
+        start_point=start_point,
+        old_end_point=old_end_point,
+        new_end_point=new_end_point,
+    )
+
+def _shift(span: Span, edit: Edit) -> Span:
+    # Spans that end before the edit keep their offsets, spans after it move by the edit's delta
+    start = span.start if span.start <= edit.start_byte else max(span.start + edit.delta, edit.new_end_byte)
+    end = span.end if span.end <= edit.start_byte else max(span.end + edit.delta, edit.new_end_byte)
+    return Span(start, end)
+
+def _cover_nodes(node: Node, lo: int, hi: int, cover: List[Node]):
+    # Shallowest nodes overlapping [lo, hi); leaves straddling a boundary are kept whole
+    stack = [iter_children(node)]
+    while stack:
+        for child in stack[-1]:
+            if child.end_byte <= lo or child.start_byte >= hi:
+                continue
+            if (lo <= child.start_byte and child.end_byte <= hi) or not child.child_count:
+                cover.append(child)
+            else:
+                stack.append(iter_children(child))
+                break
+        else:
+            stack.pop()
+
+def rechunk(
+    parser: Parser,
+    old_tree: Tree,
+    old_source: bytes,
+    old_spans: List[Span],
+    edit: Edit,
+    MAX_CHARS=512 * 3,
+    coalesce=50
+) -> Tuple[Tree, bytes, List[Span]]:
+    # old_spans are byte spans from chunk_spans; returns the new tree, source and byte spans
+    source_code = edit.apply(old_source)
+    edit_tree(old_tree, old_source, edit)
+    tree = parser.parse(source_code, old_tree)
+    if not old_spans:
+        return tree, source_code, chunk_spans(tree, source_code, MAX_CHARS, coalesce)
+
+    # Everything that changed, in new offsets
+    lo, hi = edit.start_byte, edit.new_end_byte
+    for changed in old_tree.changed_ranges(tree):
+        lo, hi = min(lo, changed.start_byte), max(hi, changed.end_byte)
+
+    shifted = [span for span in (_shift(span, edit) for span in old_spans) if len(span) > 0]
+    while shifted and shifted[-1].start >= tree.root_node.end_byte:
+        shifted.pop()
+    if not shifted:
+        return tree, source_code, chunk_spans(tree, source_code, MAX_CHARS, coalesce)
+    shifted[-1].end = tree.root_node.end_byte
+    while True:
+        # Widen the dirty region to whole old chunks, then to whole nodes, until both agree
+        first = next((i for i, span in enumerate(shifted) if span.end > lo), len(shifted) - 1)
+        last = next((i for i in range(len(shifted) - 1, -1, -1) if shifted[i].start < hi), 0)
+        last = max(first, last)
+        region_start, region_end = shifted[first].start, shifted[last].end
+        cover: List[Node] = []
+        _cover_nodes(tree.root_node, region_start, region_end, cover)
+        if cover:
+            lo, hi = min(region_start, cover[0].start_byte), max(region_end, cover[-1].end_byte)
+        else:
+            lo, hi = region_start, region_end
+        if (lo, hi) == (region_start, region_end):
+            break
+
+    # Same passes as chunker, restricted to the region
+    chunks = chunk_children(cover, region_start, MAX_CHARS) if cover else [Span(region_start, region_end)]
+    chunks = fill_gaps(chunks, region_end)
+    region = coalesce_chunks(chunks, source_code, coalesce, region_start)
+
+    after = shifted[last + 1:]
+    if region and after and not is_coalesced(region[-1], source_code, coalesce):
+        # A small trailing chunk would have been merged into the next one
+        after[0] = region.pop() + after[0]
+    return tree, source_code, shifted[:first] + region + after
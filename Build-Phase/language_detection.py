@@ -0,0 +1,122 @@
+import os
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+from tree_sitter import Language, Parser
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+PREFIX_BYTES = 4096  # how much of the file a trial parse looks at
+MIN_SCORE = 3  # lexical score needed to skip the trial parse
+MIN_MARGIN = 2  # and how far ahead of the runner-up it has to be
+
+EXTENSIONS = {
+    '.py': 'python', '.pyw': 'python', '.pyi': 'python',
+    '.java': 'java',
+    '.cc': 'cpp', '.cpp': 'cpp', '.cxx': 'cpp', '.hpp': 'cpp', '.hh': 'cpp', '.hxx': 'cpp', '.h': 'cpp',
+    '.go': 'go',
+    '.rs': 'rust',
+    '.rb': 'ruby', '.rake': 'ruby', '.gemspec': 'ruby',
+    '.php': 'php', '.phtml': 'php',
+}
+SHEBANGS = {
+    'python': 'python', 'python2': 'python', 'python3': 'python',
+    'ruby': 'ruby',
+    'php': 'php',
+}
+SIGNALS = {
+    'python': [rb'^\s*def \w+\(.*\)\s*(->.*)?:\s*$', rb'^\s*class \w+(\(.*\))?:\s*$',
+               rb'^\s*from [\w.]+ import ', rb'^\s*import [\w.]+\s*$', rb'^\s*(el)?if .*:\s*$',
+               rb'\bself\.', rb'^\s*@\w+'],
+    'java': [rb'^\s*package [\w.]+;', rb'^\s*import [\w.*]+;', rb'\b(public|private|protected)\s+(static\s+)?(final\s+)?\w+[\w<>\[\]]*\s+\w+\s*\(',
+             rb'\bclass \w+(\s+extends \w+)?(\s+implements [\w, ]+)?\s*\{', rb'System\.out\.', rb'@Override'],
+    'cpp': [rb'^\s*#\s*include\s*[<"]', rb'\bstd::', rb'\btemplate\s*<', rb'^\s*#\s*(define|ifndef|pragma)\b',
+            rb'\bnamespace \w+\s*\{', rb'::\w+\s*\(', rb'->\w+'],
+    'go': [rb'^package \w+\s*$', rb'^\s*func (\(.*\) )?\w+\(', rb':=', rb'^import \($', rb'\bfmt\.\w+\('],
+    'rust': [rb'\bfn \w+(<.*>)?\(', rb'\blet (mut )?\w+', rb'^\s*use \w+(::\w+)+', rb'^\s*impl\b', rb'\bpub (fn|struct|enum|mod)\b',
+             rb'\w+!\(', rb'&(mut )?self\b'],
+    'ruby': [rb'^\s*end\s*$', rb'^\s*require(_relative)? [\'"]', rb'^\s*def \w+[?!]?(\(.*\))?\s*$', rb'\bdo(\s*\|.*\|)?\s*$',
+             rb'^\s*module \w+\s*$', rb'\battr_(reader|writer|accessor)\b', rb'\bputs\b'],
+    'php': [rb'<\?php', rb'\$\w+\s*=', rb'\bfunction \w+\s*\(', rb'\becho\b', rb'->\w+', rb'^\s*namespace [\w\\]+;'],
+}
+_COMPILED_SIGNALS = {language: [re.compile(pattern, re.MULTILINE) for pattern in patterns]
+                     for language, patterns in SIGNALS.items()}
+
+def language_from_path(path: Optional[str]) -> Optional[str]:
+    if not path:
+        return None
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+def language_from_shebang(source_code: bytes) -> Optional[str]:
+    if source_code.startswith(b'<?php'):
+        return 'php'
+    if not source_code.startswith(b'#!'):
+        return None
+    end = source_code.find(b'\n')
+    if end == -1:
+        end = len(source_code)
+    words = source_code[2:end].decode('utf-8', 'replace').split()
+    for word in words:
+        interpreter = os.path.basename(word)
+        if interpreter in SHEBANGS:
+            return SHEBANGS[interpreter]
+        if interpreter != 'env' and not interpreter.startswith('-'):
+            break
+    return None
+
+def lexical_scores(prefix: bytes, candidates: List[str]) -> List[Tuple[int, str]]:
+    scores = [(sum(1 for pattern in _COMPILED_SIGNALS.get(name, []) if pattern.search(prefix)), name)
+              for name in candidates]
+    return sorted(scores, key=lambda score: -score[0])
+
+def _cut_prefix(source_code: bytes) -> bytes:
+    # Stop the prefix at a line boundary so the trial parse doesn't end inside a token
+    if len(source_code) <= PREFIX_BYTES:
+        return source_code
+    end = source_code.rfind(b'\n', 0, PREFIX_BYTES)
+    return source_code[:end if end > 0 else PREFIX_BYTES]
+
+class LanguageDetector:
+    # Extension, shebang and lexical signals first; a trial parse of a bounded prefix only when unsure
+
+    def __init__(self, languages: Dict[str, Language], metrics: Optional[Metrics] = None):
+        self.languages = languages
+        self.parsers: Dict[str, Parser] = {}
+        self.metrics = metrics
+
+    def parser(self, language_name: str) -> Parser:
+        parser = self.parsers.get(language_name)
+        if parser is None:
+            parser = Parser()
+            parser.language = self.languages[language_name]
+            self.parsers[language_name] = parser
+        return parser
+
+    def _detected(self, language_name: Optional[str], signal: str) -> Optional[str]:
+        if self.metrics is not None:
+            self.metrics.count('detections')
+            self.metrics.count(f'detected_by_{signal}')
+        return language_name
+
+    def detect(self, source_code: bytes, path: Optional[str] = None) -> Optional[str]:
+        signals = (('path', language_from_path(path)), ('shebang', language_from_shebang(source_code)))
+        for signal, language_name in signals:
+            if language_name in self.languages:
+                return self._detected(language_name, signal)
+
+        prefix = _cut_prefix(source_code)
+        scores = lexical_scores(prefix, list(self.languages))
+        if scores and scores[0][0] >= MIN_SCORE \
+            and (len(scores) == 1 or scores[0][0] - scores[1][0] >= MIN_MARGIN):
+            return self._detected(scores[0][1], 'lexical')
+
+        # Still unsure: trial-parse the prefix, most likely languages first
+        for _, language_name in scores:
+            if self.metrics is not None:
+                self.metrics.count('trial_parses')
+            tree = self.parser(language_name).parse(prefix)
+            if not tree.root_node.children or tree.root_node.children[0].type != "ERROR":
+                return self._detected(language_name, 'trial_parse')
+            logger.debug(f"Not language {language_name}")
+        return self._detected(None, 'none')
@@ -0,0 +1,37 @@
+from array import array
+from bisect import bisect_left
+from typing import Tuple
+
+class LineIndex:
+    # Newline offsets of one source buffer, built once and looked up by bisection.
+    # Rows and columns are 0-based like tree-sitter points, line numbers are 1-based.
+
+    def __init__(self, source_code: bytes):
+        self.length = len(source_code)
+        self.newlines = array('q')
+        find = source_code.find
+        pos = find(b'\n')
+        while pos != -1:
+            self.newlines.append(pos)
+            pos = find(b'\n', pos + 1)
+
+    def __len__(self):
+        return len(self.newlines) + 1
+
+    def line_number(self, byte_offset: int) -> int:
+        # Same result as source_code[:byte_offset].count(b'\n') + 1
+        return bisect_left(self.newlines, byte_offset) + 1
+
+    def line_start(self, row: int) -> int:
+        return self.newlines[row - 1] + 1 if row > 0 else 0
+
+    def line_end(self, row: int) -> int:
+        # Offset of the newline ending the row (or the end of the buffer)
+        return self.newlines[row] if row < len(self.newlines) else self.length
+
+    def point(self, byte_offset: int) -> Tuple[int, int]:
+        row = bisect_left(self.newlines, byte_offset)
+        return row, byte_offset - self.line_start(row)
+
+    def byte_offset(self, row: int, column: int) -> int:
+        return self.line_start(row) + column
@@ -0,0 +1,59 @@
+import os
+import mmap
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+import numpy as np
+
+BLOCK_SIZE = 1 << 22  # bytes scanned for newlines at a time
+
+def iter_newlines(buffer, block_size=BLOCK_SIZE) -> Iterator[np.ndarray]:
+    # Offsets of every b'\n' in any buffer (bytes, mmap, ...), one block at a time.
+    # For an mmap, pages two blocks behind the scan are dropped from this process (they stay
+    # in the page cache), so resident memory doesn't grow with the file
+    release = None
+    if hasattr(mmap, 'MADV_DONTNEED') and block_size % mmap.PAGESIZE == 0:
+        release = getattr(buffer, 'madvise', None)
+    with memoryview(buffer) as view:
+        for start in range(0, len(view), block_size):
+            block = np.frombuffer(view[start:start + block_size], dtype=np.uint8)
+            newlines = np.flatnonzero(block == 10) + start
+            del block
+            if release is not None and start >= 2 * block_size:
+                release(mmap.MADV_DONTNEED, start - 2 * block_size, block_size)
+            yield newlines
+
+def iter_line_windows(buffer, chunk_size: int, overlap: int, block_size=BLOCK_SIZE) -> Iterator[Tuple[int, int]]:
+    # Byte ranges of windows of chunk_size lines, each starting chunk_size - overlap lines after
+    # the previous one, from a single scan. Same ranges as slicing text.split('\n') into windows
+    # and joining them back, but only the windows still open are kept in memory.
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError(f"overlap ({overlap}) must be smaller than chunk_size ({chunk_size})")
+    open_windows = deque([0])  # start offsets of windows whose last line hasn't been reached
+    line = 0  # index of the line the next newline ends
+    for newlines in iter_newlines(buffer, block_size):
+        lines = np.arange(line, line + len(newlines))
+        # A newline ending line i closes the window whose last line is i, and opens one at i + 1
+        closes = (lines >= chunk_size - 1) & ((lines - (chunk_size - 1)) % step == 0)
+        opens = (lines + 1) % step == 0
+        events = np.flatnonzero(closes | opens)
+        for offset, close, open_ in zip(newlines[events].tolist(), closes[events].tolist(), opens[events].tolist()):
+            if close:
+                yield open_windows.popleft(), offset
+            if open_:
+                open_windows.append(offset + 1)
+        line += len(newlines)
+    # Whatever is still open ends with the last line
+    while open_windows:
+        yield open_windows.popleft(), len(buffer)
+
+@contextmanager
+def mapped(path: str):
+    # Read-only mmap of the file; empty files (which can't be mapped) come back as b''
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            yield source
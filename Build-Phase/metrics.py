@@ -0,0 +1,160 @@
+import os
+import abc
+import json
+import time
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterator, List, Optional
+
+@dataclass
+class PhaseStats:
+    calls: int = 0
+    seconds: float = 0.0
+    alloc_peak_bytes: int = 0  # highest traced memory above the phase's start, over all calls
+    alloc_net_bytes: int = 0  # traced memory still held when each call ended, summed
+
+class Metrics:
+    # Time, allocations and counts per pipeline phase. Pass one to chunker/chunk to record
+    # into it; leaving it out costs nothing. Allocations are only traced with
+    # trace_allocations, which starts tracemalloc and slows everything down noticeably.
+
+    def __init__(self, trace_allocations=False, sinks: Optional[List["Sink"]] = None):
+        self.trace_allocations = trace_allocations
+        self.sinks = list(sinks or [])
+        self.phases: Dict[str, PhaseStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()  # open phases of the current thread, for nesting
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self) -> List[list]:
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _fold_peak(self, stack: List[list]):
+        # tracemalloc keeps a single peak, so it is handed to every open phase before a reset
+        _, peak = tracemalloc.get_traced_memory()
+        for frame in stack:
+            frame[1] = max(frame[1], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        tracing = self.trace_allocations and tracemalloc.is_tracing()
+        stack = self._stack()
+        if tracing:
+            self._fold_peak(stack)
+            current, _ = tracemalloc.get_traced_memory()
+            frame = [current, current]  # memory at start, peak seen so far
+            stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = net = 0
+            if tracing:
+                self._fold_peak(stack)
+                stack.pop()
+                current, _ = tracemalloc.get_traced_memory()
+                peak, net = frame[1] - frame[0], current - frame[0]
+            with self.lock:
+                stats = self.phases.get(name)
+                if stats is None:
+                    stats = self.phases[name] = PhaseStats()
+                stats.calls += 1
+                stats.seconds += seconds
+                stats.alloc_peak_bytes = max(stats.alloc_peak_bytes, peak)
+                stats.alloc_net_bytes += net
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'timestamp': time.time(),
+                'phases': {name: asdict(stats) for name, stats in self.phases.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+            }
+
+    def flush(self):
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.write(snapshot)
+
+    def reset(self):
+        with self.lock:
+            self.phases.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+def phase(metrics: Optional[Metrics], name: str):
+    # metrics.phase(name), or a no-op when no metrics are being recorded
+    return metrics.phase(name) if metrics is not None else nullcontext()
+
+class Sink(abc.ABC):
+    @abc.abstractmethod
+    def write(self, snapshot: dict):
+        ...
+
+class JsonLinesSink(Sink):
+    # Appends one snapshot per line
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, snapshot: dict):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(snapshot) + '\n')
+
+class PrometheusSink(Sink):
+    # Prometheus text exposition format, replaced atomically on every write so the node
+    # exporter's textfile collector never reads a half-written file
+    def __init__(self, path: str, prefix='codesplitter'):
+        self.path = path
+        self.prefix = prefix
+
+    def render(self, snapshot: dict) -> str:
+        lines = []
+        phase_metrics = [('phase_calls_total', 'counter', 'calls'),
+                         ('phase_seconds_total', 'counter', 'seconds'),
+                         ('phase_alloc_peak_bytes', 'gauge', 'alloc_peak_bytes'),
+                         ('phase_alloc_net_bytes', 'gauge', 'alloc_net_bytes')]
+        for metric, metric_type, field_name in phase_metrics:
+            lines.append(f"# TYPE {self.prefix}_{metric} {metric_type}")
+            for name, stats in sorted(snapshot['phases'].items()):
+                lines.append(f'{self.prefix}_{metric}{{phase="{name}"}} {stats[field_name]}')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {value}")
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, snapshot: dict):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-', suffix='.prom')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render(snapshot))
+            os.chmod(temp_path, 0o644)  # mkstemp creates it readable by the owner only
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
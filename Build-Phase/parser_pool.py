@@ -0,0 +1,55 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple, Union
+from tree_sitter import Language, Parser, Query
+from grammars import REGISTRY, GrammarRegistry
+
+class ParserPool:
+    # Reusable parsers per language and compiled queries keyed by their source text.
+    # A Parser is not safe to share between threads, so each one is lent out exclusively;
+    # compiled queries are shared.
+
+    def __init__(self, grammars: GrammarRegistry = REGISTRY):
+        self.grammars = grammars
+        self.idle: Dict[Language, List[Parser]] = {}
+        self.queries: Dict[Tuple[Language, str], Query] = {}
+        self.lock = threading.Lock()
+
+    def language(self, language: Union[str, Language]) -> Language:
+        return self.grammars[language] if isinstance(language, str) else language
+
+    def acquire(self, language: Union[str, Language]) -> Parser:
+        language = self.language(language)
+        with self.lock:
+            idle = self.idle.get(language)
+            if idle:
+                return idle.pop()
+        parser = Parser()
+        parser.language = language
+        return parser
+
+    def release(self, parser: Parser):
+        with self.lock:
+            self.idle.setdefault(parser.language, []).append(parser)
+
+    @contextmanager
+    def parser(self, language: Union[str, Language]) -> Iterator[Parser]:
+        parser = self.acquire(language)
+        try:
+            yield parser
+        finally:
+            self.release(parser)
+
+    def query(self, language: Union[str, Language], source: str) -> Query:
+        language = self.language(language)
+        key = (language, source)
+        query = self.queries.get(key)
+        if query is None:
+            # Compiling twice in a race is harmless, the first one stored wins
+            query = language.query(source)
+            with self.lock:
+                query = self.queries.setdefault(key, query)
+        return query
+
+# Shared by every entry point in the process
+POOL = ParserPool()
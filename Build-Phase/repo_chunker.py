@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import logging
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from tree_sitter import Parser
+from build3 import Span, chunker
+from language_detection import language_from_path
+from chunk_cache import ChunkCache, cached_chunker, grammar_version
+from grammars import REGISTRY, VENDOR_DIR, GrammarRegistry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LANGUAGES_DIR = 'cache/build'  # prebuilt <lang>.so files for grammars without a wheel
+SKIP_DIRS = {'.git', 'node_modules', '__pycache__', '.venv', 'venv', 'cache'}
+
+@dataclass
+class ChunkStats:
+    files: int = 0
+    bytes: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.files} files, {self.chunks} chunks, {self.bytes / (1024 * 1024):.1f} MB "
+                f"in {self.seconds:.2f}s ({self.files_per_second:.1f} files/s, {self.mb_per_second:.2f} MB/s)")
+
+def iter_source_files(root: str, registry: GrammarRegistry = REGISTRY) -> Iterator[str]:
+    # Files of a known language whose grammar loads; the rest would only fail in the workers
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        for filename in sorted(filenames):
+            language = language_from_path(filename)
+            if language is not None and registry.is_available(language):
+                yield os.path.join(dirpath, filename)
+
+# Per-worker state: one warm parser per language, created on first use
+_worker_parsers: Dict[str, Parser] = {}
+_worker_options: Dict[str, object] = {}
+_worker_versions: Dict[str, str] = {}
+_worker_grammars: Dict[str, GrammarRegistry] = {}
+
+def _init_worker(languages_dir: str, max_chars: int, coalesce: int, cache_path: Optional[str]):
+    _worker_parsers.clear()
+    _worker_versions.clear()
+    _worker_grammars['registry'] = GrammarRegistry(search_dirs=[VENDOR_DIR, languages_dir])
+    _worker_options.update(languages_dir=languages_dir, max_chars=max_chars, coalesce=coalesce,
+                           cache=ChunkCache(cache_path) if cache_path else None)
+
+def _worker_parser(language: str) -> Parser:
+    parser = _worker_parsers.get(language)
+    if parser is None:
+        parser = Parser()
+        parser.language = _worker_grammars['registry'][language]
+        _worker_parsers[language] = parser
+    return parser
+
+def _chunk_file(path: str) -> Tuple[str, Optional[str], int, List[Tuple[int, int]]]:
+    language = language_from_path(path)
+    try:
+        with open(path, 'rb') as f:
+            source_code = f.read()
+    except OSError as e:
+        # A broken symlink or a file deleted mid-run fails on its own, not the whole run
+        logger.warning(f"Failed to read {path}: {e}")
+        return path, language, 0, []
+    if language is None or not source_code:
+        return path, language, len(source_code), []
+    try:
+        cache = _worker_options['cache']
+        if cache is not None:
+            if language not in _worker_versions:
+                _worker_versions[language] = grammar_version(language, _worker_grammars['registry'])
+            spans = cached_chunker(cache, _worker_parser(language), source_code, language, _worker_versions[language],
+                                   _worker_options['max_chars'], _worker_options['coalesce'])
+        else:
+            tree = _worker_parser(language).parse(source_code)
+            spans = chunker(tree, source_code, _worker_options['max_chars'], _worker_options['coalesce'])
+    except Exception as e:
+        logger.warning(f"Failed to chunk {path}: {e}")
+        return path, language, len(source_code), []
+    # Plain tuples are cheaper to pickle back to the parent than Span objects
+    return path, language, len(source_code), [(span.start, span.end) for span in spans]
+
+def chunk_files(
+    paths: Iterable[str],
+    processes: Optional[int] = None,
+    languages_dir: str = LANGUAGES_DIR,
+    MAX_CHARS=512 * 3,
+    coalesce=50,
+    shard_size=16,  # files handed to a worker at a time
+    cache_path: Optional[str] = None,  # e.g. chunk_cache.DEFAULT_CACHE_PATH to reuse spans of unchanged files
+    stats: Optional[ChunkStats] = None
+) -> Iterator[Tuple[str, Optional[str], List[Span]]]:
+    # Yields (path, language, spans) in the order of `paths` while the pool keeps working ahead
+    stats = stats if stats is not None else ChunkStats()
+    start = time.perf_counter()
+    with Pool(processes, initializer=_init_worker, initargs=(languages_dir, MAX_CHARS, coalesce, cache_path)) as pool:
+        for path, language, size, spans in pool.imap(_chunk_file, paths, chunksize=shard_size):
+            stats.files += 1
+            stats.bytes += size
+            stats.chunks += len(spans)
+            stats.seconds = time.perf_counter() - start
+            yield path, language, [Span(start_line, end_line) for start_line, end_line in spans]
+    logger.info(f"Chunked {stats}")
+
+def chunk_repository(root: str, **kwargs) -> Iterator[Tuple[str, Optional[str], List[Span]]]:
+    # Filtered against the grammars the workers will find
+    registry = GrammarRegistry(search_dirs=[VENDOR_DIR, kwargs.get('languages_dir', LANGUAGES_DIR)])
+    return chunk_files(iter_source_files(root, registry), **kwargs)
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else '.'
+    stats = ChunkStats()
+    for path, language, spans in chunk_repository(root, stats=stats):
+        print(f"{path} ({language}): {len(spans)} chunks")
+    print(stats)
+
+if __name__ == "__main__":
+    main()
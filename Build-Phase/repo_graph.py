@@ -0,0 +1,188 @@
+import os
+import sys
+import time
+import logging
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import networkx as nx
+from tree_sitter import Node
+from extract import extract
+from parser_pool import POOL
+from repo_chunker import SKIP_DIRS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Node ids: "pkg.mod" for modules, "pkg.mod:Class.method" for anything defined inside one
+REFERENCES_QUERY = """
+(import_statement) @import
+(import_from_statement) @import_from
+(call function: (identifier) @call.name)
+(call function: (attribute attribute: (identifier) @call.attribute))
+"""
+
+@dataclass
+class FileGraph:
+    # What one file contributes; only plain strings, so it is cheap to send between processes
+    path: str
+    module: str
+    nodes: List[Tuple[str, str, int]] = field(default_factory=list)  # (id, type, line)
+    contains: List[Tuple[str, str]] = field(default_factory=list)
+    # Edges whose target is only known once every file is in: (source, candidate targets in order)
+    imports: List[Tuple[str, Tuple[str, ...]]] = field(default_factory=list)
+    calls: List[Tuple[str, Tuple[str, ...]]] = field(default_factory=list)
+
+def module_name(path: str, root: str) -> str:
+    relative = os.path.splitext(os.path.relpath(path, root))[0]
+    parts = relative.split(os.sep)
+    if parts[-1] == '__init__' and len(parts) > 1:
+        parts.pop()
+    return '.'.join(parts)
+
+def iter_python_files(root: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                yield os.path.join(dirpath, filename)
+
+def _text(node: Node, source_code: bytes) -> str:
+    return source_code[node.start_byte:node.end_byte].decode('utf8', 'replace')
+
+def _resolve_relative(module: str, is_package: bool, prefix_dots: int, name: str) -> str:
+    package = module.split('.') if is_package else module.split('.')[:-1]
+    if prefix_dots > 1:
+        package = package[:len(package) - (prefix_dots - 1)]
+    return '.'.join(part for part in package + ([name] if name else []) if part)
+
+def file_graph(path: str, root: str) -> FileGraph:
+    module = module_name(path, root)
+    with open(path, 'rb') as f:
+        source_code = f.read()
+    extraction = extract(source_code)
+    result = FileGraph(path, module)
+    result.nodes.append((module, 'module', 1))
+
+    top_level = set()
+    for construct in extraction.of_kind('class', 'function', 'method', 'global_var'):
+        node_id = f"{module}:{construct.name}"
+        result.nodes.append((node_id, construct.kind, construct.start_line))
+        result.contains.append((f"{module}:{construct.parent}" if construct.parent else module, node_id))
+        if construct.parent is None:
+            top_level.add(construct.name)
+
+    # Name bound by an import -> module it names, or (module, symbol) for from-imports
+    modules: Dict[str, str] = {}
+    symbols: Dict[str, Tuple[str, str]] = {}
+    calls: Set[Tuple[str, Tuple[str, ...]]] = set()
+    is_package = os.path.basename(path) == '__init__.py'
+    query = POOL.query('python', REFERENCES_QUERY)
+    for node, capture_name in query.captures(extraction.tree.root_node):
+        if capture_name == 'import':
+            for name in node.children_by_field_name('name'):
+                if name.type == 'aliased_import':
+                    target = _text(name.child_by_field_name('name'), source_code)
+                    modules[_text(name.child_by_field_name('alias'), source_code)] = target
+                else:
+                    target = _text(name, source_code)
+                    modules[target.split('.')[0]] = target.split('.')[0]
+                result.imports.append((module, (target,)))
+        elif capture_name == 'import_from':
+            module_node = node.child_by_field_name('module_name')
+            if module_node is None:
+                continue
+            if module_node.type == 'relative_import':
+                prefix = next(child for child in module_node.children if child.type == 'import_prefix')
+                dotted = next((child for child in module_node.children if child.type == 'dotted_name'), None)
+                base = _resolve_relative(module, is_package, len(_text(prefix, source_code)),
+                                         _text(dotted, source_code) if dotted else '')
+            else:
+                base = _text(module_node, source_code)
+            names = node.children_by_field_name('name')
+            if not names:
+                result.imports.append((module, (base,)))
+            for name in names:
+                alias = name
+                if name.type == 'aliased_import':
+                    alias = name.child_by_field_name('alias')
+                    name = name.child_by_field_name('name')
+                imported = _text(name, source_code)
+                symbols[_text(alias, source_code)] = (base, imported)
+                result.imports.append((module, (f"{base}.{imported}", base)))
+        else:
+            scope = extraction.enclosing(node.start_byte, node.end_byte)
+            caller = f"{module}:{scope.name}" if scope else module
+            name = _text(node, source_code)
+            if capture_name == 'call.name':
+                if name in top_level:
+                    calls.add((caller, (f"{module}:{name}",)))
+                elif name in symbols:
+                    base, imported = symbols[name]
+                    calls.add((caller, (f"{base}:{imported}",)))
+            else:
+                owner = _text(node.parent.child_by_field_name('object'), source_code)
+                if owner in ('self', 'cls') and scope is not None and scope.kind == 'method':
+                    calls.add((caller, (f"{module}:{scope.parent}.{name}",)))
+                elif owner.split('.')[0] in modules:
+                    head, _, rest = owner.partition('.')
+                    calls.add((caller, (f"{modules[head]}{'.' if rest else ''}{rest}:{name}",)))
+                elif owner in symbols:
+                    base, imported = symbols[owner]
+                    calls.add((caller, (f"{base}.{imported}:{name}", f"{base}:{imported}.{name}")))
+                elif owner in top_level:
+                    calls.add((caller, (f"{module}:{owner}.{name}",)))
+    result.calls = sorted(calls)
+    return result
+
+def _file_graph(args: Tuple[str, str]) -> Optional[FileGraph]:
+    path, root = args
+    try:
+        return file_graph(path, root)
+    except Exception as e:
+        logger.warning(f"Failed to read {path}: {e}")
+        return None
+
+def build_repo_graph(root: str, processes: Optional[int] = None, graph=None, shard_size=32):
+    # Files are analysed in parallel and merged as they arrive; workers keep no trees and
+    # send back strings only, so memory stays proportional to the graph itself
+    G = graph if graph is not None else nx.DiGraph()
+    imports: List[Tuple[str, Tuple[str, ...]]] = []
+    calls: List[Tuple[str, Tuple[str, ...]]] = []
+    start = time.perf_counter()
+    files = 0
+    with Pool(processes) as pool:
+        jobs = ((path, root) for path in iter_python_files(root))
+        for result in pool.imap_unordered(_file_graph, jobs, chunksize=shard_size):
+            if result is None:
+                continue
+            files += 1
+            for node_id, node_type, line in result.nodes:
+                G.add_node(node_id, type=node_type, file=result.path, line=line)
+            for parent, child in result.contains:
+                G.add_edge(parent, child, kind='contains')
+            imports.extend(result.imports)
+            calls.extend(result.calls)
+
+    # Targets resolve to the first candidate that exists anywhere in the repo
+    for source, candidates in imports:
+        target = next((candidate for candidate in candidates if G.has_node(candidate)), None)
+        if target is None:
+            target = candidates[-1]
+            G.add_node(target, type='external')
+        G.add_edge(source, target, kind='imports')
+    for source, candidates in calls:
+        target = next((candidate for candidate in candidates if G.has_node(candidate)), None)
+        if target is not None and G.has_node(source):
+            G.add_edge(source, target, kind='calls')
+    logger.info(f"Built graph of {files} files in {time.perf_counter() - start:.2f}s: "
+                f"{G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
+    return G
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else '.'
+    G = build_repo_graph(root)
+    print(f"{G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
+
+if __name__ == "__main__":
+    main()
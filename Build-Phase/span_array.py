@@ -0,0 +1,101 @@
+from typing import Iterator, List, Optional, Union
+import numpy as np
+from tree_sitter import Tree
+from build3 import Span, chunk_node
+from line_index import LineIndex
+from text_stats import TextStats
+
+class SpanArray:
+    # Parallel int64 start/end arrays standing in for a list of Span objects
+
+    def __init__(self, starts, ends):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_spans(cls, spans: List[Span]) -> 'SpanArray':
+        return cls([span.start for span in spans], [span.end for span in spans])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index) -> Union[Span, 'SpanArray']:
+        if isinstance(index, (int, np.integer)):
+            return Span(int(self.starts[index]), int(self.ends[index]))
+        return SpanArray(self.starts[index], self.ends[index])
+
+    def __iter__(self) -> Iterator[Span]:
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield Span(start, end)
+
+    def __eq__(self, other):
+        return isinstance(other, SpanArray) \
+            and np.array_equal(self.starts, other.starts) and np.array_equal(self.ends, other.ends)
+
+    def __repr__(self):
+        return f"SpanArray({len(self)} spans)"
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.ends - self.starts
+
+    def to_spans(self) -> List[Span]:
+        return list(self)
+
+    def fill_gaps(self, end_byte: int) -> 'SpanArray':
+        if not len(self):
+            return SpanArray(self.starts, self.ends)
+        ends = np.empty_like(self.ends)
+        ends[:-1] = self.starts[1:]
+        ends[-1] = end_byte
+        return SpanArray(self.starts, ends)
+
+    def coalesce(self, source_code: bytes, coalesce=50, start_byte=0, stats: Optional[TextStats] = None) -> 'SpanArray':
+        # Same result as build3.coalesce_chunks on contiguous spans. With the prefix sums
+        # the end of each merged chunk is one binary search over the chunk ends.
+        if not len(self):
+            return SpanArray([], [])
+        stats = stats if stats is not None else TextStats(source_code)
+        # Prefix sums are indexed from stats.start, which is 0 unless they cover a range only
+        non_whitespace, newlines, base = stats.non_whitespace, stats.newlines, stats.start
+        non_whitespace_at_end = non_whitespace[self.ends - base]
+        newlines_at_end = newlines[self.ends - base]
+
+        starts, ends = [], []
+        current = start_byte
+        i, n = 0, len(self)
+        while i < n:
+            start = min(current, int(self.starts[i]))
+            j = max(i,
+                    int(np.searchsorted(non_whitespace_at_end, non_whitespace[start - base] + coalesce, side='right')),
+                    int(np.searchsorted(newlines_at_end, newlines[start - base], side='right')))
+            if j >= n:
+                if int(self.ends[-1]) > start:
+                    starts.append(start)
+                    ends.append(int(self.ends[-1]))
+                break
+            starts.append(start)
+            ends.append(int(self.ends[j]))
+            current = int(self.ends[j])
+            i = j + 1
+        return SpanArray(starts, ends)
+
+    def to_lines(self, line_index: LineIndex) -> 'SpanArray':
+        newlines = np.frombuffer(line_index.newlines, dtype=np.int64)
+        return SpanArray(np.searchsorted(newlines, self.starts, side='left') + 1,
+                         np.searchsorted(newlines, self.ends, side='left') + 1)
+
+    def nonempty(self) -> 'SpanArray':
+        return self[self.lengths > 0]
+
+def chunker_array(
+    tree: Tree,
+    source_code: bytes,
+    MAX_CHARS=512 * 3,
+    coalesce=50
+) -> SpanArray:
+    # build3.chunker with the gap filling, coalescing and line passes done on arrays
+    chunks = SpanArray.from_spans(chunk_node(tree.root_node, MAX_CHARS))
+    chunks = chunks.fill_gaps(tree.root_node.end_byte)
+    chunks = chunks.coalesce(source_code, coalesce)
+    return chunks.to_lines(LineIndex(source_code)).nonempty()
@@ -0,0 +1,29 @@
+from typing import Optional
+import numpy as np
+
+WHITESPACE = np.zeros(256, dtype=bool)
+WHITESPACE[list(b' \t\n\r\x0b\x0c')] = True  # what rb'\s' matches
+
+class TextStats:
+    # Prefix sums of non-whitespace bytes and newlines, built once per source buffer,
+    # so both are O(1) lookups for any byte range. With start/end only that part of the
+    # buffer is summed, and lookups must stay inside it.
+
+    def __init__(self, source_code: bytes, start=0, end: Optional[int] = None):
+        end = len(source_code) if end is None else end
+        self.start = start
+        data = np.frombuffer(source_code, dtype=np.uint8, count=end - start, offset=start)
+        dtype = np.uint32 if len(data) < 2 ** 32 else np.int64
+        self.non_whitespace = np.zeros(len(data) + 1, dtype=dtype)
+        np.cumsum(~WHITESPACE[data], dtype=dtype, out=self.non_whitespace[1:])
+        self.newlines = np.zeros(len(data) + 1, dtype=dtype)
+        np.cumsum(data == 10, dtype=dtype, out=self.newlines[1:])
+
+    def non_whitespace_len(self, start: int, end: int) -> int:
+        return int(self.non_whitespace[end - self.start]) - int(self.non_whitespace[start - self.start])
+
+    def newline_count(self, start: int, end: int) -> int:
+        return int(self.newlines[end - self.start]) - int(self.newlines[start - self.start])
+
+    def has_newline(self, start: int, end: int) -> bool:
+        return self.newlines[end - self.start] != self.newlines[start - self.start]
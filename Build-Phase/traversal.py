@@ -0,0 +1,32 @@
+from typing import Iterator, Optional, Tuple
+from tree_sitter import Node
+
+def iter_children(node: Node) -> Iterator[Node]:
+    # Children through a TreeCursor instead of building the node.children list
+    cursor = node.walk()
+    if not cursor.goto_first_child():
+        return
+    yield cursor.node
+    while cursor.goto_next_sibling():
+        yield cursor.node
+
+def walk(node: Node, max_depth: Optional[int] = None) -> Iterator[Tuple[Node, int, bool]]:
+    # Pre-order (node, depth, is_last) with an explicit stack of cursors, one per open level,
+    # so deeply nested trees never touch the recursion limit
+    yield node, 0, True
+    stack = []
+    cursor = node.walk()
+    if (max_depth is None or max_depth > 0) and cursor.goto_first_child():
+        stack.append((cursor, 1))
+    while stack:
+        cursor, depth = stack[-1]
+        child = cursor.node
+        # Moving the level's cursor ahead tells whether this child is the last one
+        is_last = not cursor.goto_next_sibling()
+        if is_last:
+            stack.pop()
+        yield child, depth, is_last
+        if child.child_count and (max_depth is None or depth < max_depth):
+            child_cursor = child.walk()
+            child_cursor.goto_first_child()
+            stack.append((child_cursor, depth + 1))